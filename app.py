@@ -1,167 +1,272 @@
-import os
-import re
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+from dataclasses import asdict
 from datetime import datetime
-from flask import Flask, request, render_template, send_from_directory, send_file
+import json
+from flask import Flask, Response, abort, g, redirect, request, render_template, send_from_directory, send_file, stream_with_context, url_for
 from dotenv import load_dotenv
-from google import genai
 
-from parse import parse_labcorp_pdf
-import fitz
+# settings for the modules below may come from .env
+load_dotenv()
+
+from batch import BATCH_MAX_PATIENTS, SummaryRequest, request_for, summarize_batch
+from cache import CacheEntry, ChartCache, ParseCache, PreviewCache, SummaryCache
+from chart import CategoryMatcher, render_report, report_key
+from engine import iter_parse
+from flags import evaluate, insulin_metrics, sort_key
+from jobs import JobQueue
+from labresult import ResultSet
+from catalog import CATALOG
+from llm import build_prompt, generate, generate_stream, shared_client, summary_key
+from metrics import collect, count, flush, render, stage, REGISTRY
+from normalize import CATALOG_VERSION, DEFAULT_RANGES, RESOLVER, normalize_rows
+from preview import find_regions, preview_key, render_preview
+from results import ResultStore, patient_key
+from storage import UPLOAD_FOLDER, UploadRequest, store, stored_path
 import io
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
 
 app = Flask(__name__)
-UPLOAD_FOLDER = "uploads"
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-
-load_dotenv()
-client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
+app.request_class = UploadRequest
+
+LAB_CATEGORIES = CATALOG.categories
+CATEGORY_MATCHER = CategoryMatcher(LAB_CATEGORIES)
+
+PARSE_CACHE = ParseCache()
+SUMMARY_CACHE = SummaryCache()
+CHART_CACHE = ChartCache()
+PREVIEW_CACHE = PreviewCache()
+JOBS = JobQueue()
+RESULTS = ResultStore()
+
+
+@app.before_request
+def start_timing():
+    g.request_start = time.perf_counter()
+    g.request_stages = ExitStack()
+    g.timings = g.request_stages.enter_context(collect())
+
+
+@app.after_request
+def record_timing(response):
+    elapsed = time.perf_counter() - g.request_start
+    endpoint = request.endpoint or "unmatched"
+    REGISTRY.observe("request_seconds", elapsed, endpoint=endpoint)
+    count("requests_total", endpoint=endpoint, status=response.status_code)
+    # stage durations so far; a streamed body is still being produced
+    timings = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in g.timings.items()]
+    response.headers["Server-Timing"] = ", ".join([*timings, f"total;dur={elapsed * 1000:.1f}"])
+    app.logger.debug(
+        "%s %s %s %.1fms %s", request.method, request.path, response.status_code, elapsed * 1000,
+        " ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in g.timings.items()),
+    )
+    flush()
+    return response
 
-from json import load
-with open('default_ranges.json') as f:
-    DEFAULT_RANGES = load(f)
 
-with open('common_aliases.json') as f:
-    COMMON_TEST_ALIASES = load(f)
+@app.teardown_request
+def stop_timing(exc):
+    if (stages := g.pop("request_stages", None)) is not None:
+        stages.close()
 
-with open('lab_categories.json') as f:
-    LAB_CATEGORIES = load(f)
 
-# Tests that should always use hard-coded reference ranges even if the
-# PDF supplies its own "Reference Interval" value.
-FORCE_DEFAULT_RANGES = {
-    "Neutrophils %",
-    "Lymphocytes %",
-    "Monocytes %",
-    "Eosinophils %",
-    "Basophils %",
-}
+@app.route("/metrics")
+def prometheus_metrics():
+    return Response(render(), mimetype="text/plain; version=0.0.4")
 
 
 @app.route("/")
 def upload():
     return render_template('upload.html.j2', year=datetime.now().year)
 
+
+def process_uploads(uploads, progress=None, incremental=False):
+    """Parse, or fetch from the cache, and normalize each uploaded PDF.
+
+    ``progress(filename, error)`` is called as each document is finished.
+    Returns the verification table data, ``(url, rows, date, digest, patient,
+    pages)`` per document sorted by collection date, where ``pages`` are the
+    pages with a table preview (``None`` if unknown), a list of ``(filename, error)``
+    for documents that failed and, when ``incremental``, a list of
+    ``(filename, date, digest)`` for documents that were verified before
+    (``None`` otherwise). Those are neither parsed nor shown again; ``/final``
+    merges their stored results instead.
+    """
+    previous = None
+    if incremental:
+        previous = []
+        verified = RESULTS.verified([upload.digest for upload in uploads])
+        for upload in uploads:
+            if upload.digest in verified:
+                _, date = verified[upload.digest]
+                previous.append((upload.filename, date, upload.digest))
+                if progress is not None:
+                    progress(upload.filename, None)
+        uploads = [upload for upload in uploads if upload.digest not in verified]
+
+    # reports seen before are served from the cache; only new content is parsed
+    entries = {upload.digest: PARSE_CACHE.get(upload.digest) for upload in uploads}
+    misses = {upload.digest: upload.source for upload in uploads if entries[upload.digest] is None}
+    failures, results = {}, {}
+
+    def resolved():
+        yield from (digest for digest, entry in entries.items() if entry is not None)
+        for digest, result in zip(misses, iter_parse(list(misses.values()))):
+            if result.ok:
+                entries[digest] = CacheEntry(result.subject_metadata, result.sample_metadata, result.rows, regions=result.regions)
+            else:
+                failures[digest] = result.error
+            yield digest
+
+    for digest in resolved():
+        entry = entries[digest]
+        if entry is None:
+            pass
+        elif 'Date Collected' not in entry.sample_metadata:
+            failures[digest] = 'Could not find "Date Collected"'
+        elif entry.normalized is None or entry.catalog != CATALOG_VERSION:
+            with stage('normalize'):
+                results[digest] = normalize_rows(entry.rows)
+            entry.normalized, entry.catalog = results[digest].to_rows(), CATALOG_VERSION
+            PARSE_CACHE.put(digest, entry)
+        else:
+            results[digest] = ResultSet.from_rows(entry.normalized)
+        if progress is not None:
+            for upload in (upload for upload in uploads if upload.digest == digest):
+                progress(upload.filename, failures.get(digest))
+
+    doc_data, errors, patients = [], [], {}
+    for upload in uploads:
+        if upload.digest in failures:
+            errors.append((upload.filename, failures[upload.digest]))
+            continue
+        entry = entries[upload.digest]
+        patient = patient_key(entry.subject_metadata)
+        patients[patient] = entry.subject_metadata
+        RESULTS.save_upload(upload.digest, patient)
+        pages = [region[0] for region in entry.regions] if entry.regions is not None else None
+        doc_data.append((upload.url, results[upload.digest], entry.sample_metadata['Date Collected'], upload.digest, patient, pages))
+
+    for patient, subject in patients.items():
+        name = subject.get('Name', [''])
+        RESULTS.save_patient(patient, name[0] if isinstance(name, list) else name, subject.get('DOB', ''))
+
+    doc_data.sort(key=lambda v: datetime.strptime(v[2], '%m/%d/%Y'))
+    return doc_data, errors, previous
+
+
 @app.route("/parse", methods=["POST"])
 def parse():
-    paths = []
-    for fstorage in request.files.getlist('file'):
-        fstorage.save(path := f"./uploads/{fstorage.filename}")
-        paths.append(path)
-
-    docs, dates = [], []
-    # Add this list of excluded test names (case-insensitive)
-    EXCLUDED_TEST_NAMES = {"pdf", "disclaimer"}
-
-    for path in paths:
-        with fitz.open(path) as doc:
-            subject_metadata, sample_metadata, data = parse_labcorp_pdf(doc)
-
-        rows = []
-        for row in data:
-            # Skip unwanted test names
-            if row["Test"].casefold() in EXCLUDED_TEST_NAMES:
-                continue
-
-            test_name_candidates = [
-                f'{row["Test"]} {row["Units"]}',
-                f'{row["Panel"]} - {row["Test"]}',
-                row["Test"],
-            ]
-
-            low, high, qualitative, units = None, None, None, row.get('Units')
-            test_name = row["Test"]
-            for candidate in test_name_candidates:
-                candidate = COMMON_TEST_ALIASES.get(candidate.casefold(), candidate)
-                if candidate in DEFAULT_RANGES:
-                    test_name = candidate
-                    match DEFAULT_RANGES[candidate]:
-                        case [qualitative, units]:
-                            pass
-                        case [low, high, units]:
-                            pass
-                        case [low, high, units, _, _, _]:
-                            pass
-                    break
-                else:
-                    test_name = candidate
-
-            # --- Force default value for C-Reactive Protein, Quant if missing ---
-            if test_name.lower() in ["c-reactive protein, quant", "c-reactive protein, qu", "c-reactive protein"]:
-                if not row["Current Result"] or row["Current Result"].strip() == "":
-                    row["Current Result"] = "<1"
-
-            if row["Reference Interval"] is not None and test_name not in FORCE_DEFAULT_RANGES:
-                if row["Reference Interval"].startswith("<"):
-                    high = row["Reference Interval"].removeprefix("<")
-                    low = "0"
-                elif row["Reference Interval"].startswith(">"):
-                    low = row["Reference Interval"].removeprefix(">")
-                    high = None
-                else:
-                    parts = re.split(r"\s*[-\u2013]\s*", row["Reference Interval"])
-                    if row['Reference Interval'].startswith(('-', '\u2013')) and len(parts) == 3:
-                        low, high = f'-{parts[0]}{parts[1]}', parts[2]
-                    else:
-                        low, high = parts[0], parts[1] if len(parts) > 1 else None
-
-            row_data = {
-                "Original": row["Test"],
-                "Standardized": test_name,
-                "Value": row["Current Result"],
-                "Units": units,
-                "Low": low,
-                "High": high,
-                "Qualitative": qualitative,
-                "Flag": row["Flag"],
-            }
-            rows.append({k: v if v is not None else "" for k, v in row_data.items()})
-        docs.append(rows)
-        dates.append(sample_metadata['Date Collected'])
-
-    from datetime import datetime
-    doc_data=sorted(zip(paths, docs, dates), key=lambda v: datetime.strptime(v[-1], '%m/%d/%Y'))
+    with stage("upload"):
+        uploads = [store(fstorage) for fstorage in request.files.getlist('file')]
+    # only verify reports that have no stored results yet
+    incremental = bool(request.form.get("incremental") or request.args.get("incremental"))
+
+    # the upload page asks for a background job and polls its progress
+    if request.args.get("async"):
+        def work(progress):
+            doc_data, errors, previous = process_uploads(uploads, progress, incremental)
+            # job results are stored as JSON
+            return [(url, rows.to_rows(), *rest) for url, rows, *rest in doc_data], errors, previous
+
+        job_id = JOBS.submit([upload.filename for upload in uploads], work)
+        return {"job": job_id, "status": url_for("job_status", job_id=job_id)}, 202
+
+    doc_data, errors, previous = process_uploads(uploads, incremental=incremental)
+    with stage("render"):
+        return render_template(
+            'verification.html.j2',
+            doc_data=doc_data,
+            errors=errors,
+            previous=previous,
+            DEFAULT_RANGES=DEFAULT_RANGES,
+        )
 
 
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = JOBS.store.get(job_id)
+    if job is None:
+        abort(404)
+    result = job.pop("result")
+    if job["status"] == "done" and isinstance(result, dict) and "summaries" in result:
+        job["summaries"] = url_for("job_summaries", job_id=job_id)
+        job["report"] = result["report"]
+    elif job["status"] == "done":
+        job["verification"] = url_for("job_verification", job_id=job_id)
+    return job
+
+
+@app.route("/jobs/<job_id>/verification")
+def job_verification(job_id):
+    job = JOBS.store.get(job_id)
+    if job is None:
+        abort(404)
+    if job["status"] != "done":
+        return redirect(url_for("upload"))
+    doc_data, errors, previous = job["result"]
+    doc_data = [(url, ResultSet.from_rows(rows), *rest) for url, rows, *rest in doc_data]
     return render_template(
         'verification.html.j2',
         doc_data=doc_data,
+        errors=errors,
+        previous=previous,
+        job_id=job_id,
         DEFAULT_RANGES=DEFAULT_RANGES,
     )
 
 @app.route("/uploads/<filename>")
 def uploaded_file(filename):
-    return send_from_directory("uploads", filename)
-
-
-def iter_multidict_items(multidict):
-    values = [multidict.getlist(key) for key in multidict.keys()]
-    clean_keys = [k.removesuffix('[]') for k in multidict.keys()]
-    for row in zip(*values):
-        yield dict(zip(clean_keys, row))
+    return send_from_directory(UPLOAD_FOLDER, filename)
+
+
+@app.route("/previews/<digest>/<int:page>.png")
+def preview(digest, page):
+    """A crop of the results table on one page of a stored upload."""
+    key = preview_key(digest, page)
+    if key in request.if_none_match:
+        return Response(status=304, headers={"ETag": f'"{key}"'})
+
+    if (png := PREVIEW_CACHE.get(key)) is None:
+        if (path := stored_path(digest)) is None:
+            abort(404)
+        entry = PARSE_CACHE.get(digest)
+        regions = entry.regions if entry is not None and entry.regions is not None else find_regions(path)
+        region = next((region for region in regions if region[0] == page), None)
+        if region is None:
+            abort(404)
+        with stage("preview"):
+            png = render_preview(path, region)
+        PREVIEW_CACHE.put(key, png)
+
+    response = send_file(io.BytesIO(png), mimetype="image/png", etag=key, max_age=24 * 60 * 60)
+    # a crop never changes, but it shows patient data
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
 
 
 @app.route("/final", methods=["POST"])
 def final():
-    import json
-
-    final_rows = []
-
     # Hard-coded list of test names that should ALWAYS have "Not Established" reference ranges
     FORCE_NOT_ESTABLISHED = ["Neutrophils", "Monocytes", "Eos", "Lymphs", "Basophils", "Lymphocytes", "Eosinophils"]
 
     # Track which specific tests were explicitly flagged in the original PDF
     EXPLICITLY_FLAGGED = set()
 
-    for row in iter_multidict_items(request.form):
-        test = row.get("test-name", "").strip()
-        val = row.get("correct-value", "").strip()
-        units = row.get("correct-units", "").strip()
-        low = row.get("correct-low", "").strip()
-        high = row.get("correct-high", "").strip()
+    # results of a background parse job are no longer needed once verified
+    form = request.form.copy()
+    if job_id := form.pop("job", None):
+        JOBS.store.delete(job_id)
+    # incremental verification: reports whose stored results are merged in
+    history = form.poplist("history")
+
+    # the verified rows are completed and flagged in place
+    final_rows = ResultSet.from_form(form)
+    for result in final_rows:
+        test, val, low, high = result.test, result.value, result.low, result.high
 
-        original_flag = row.get("Flag", "").strip()
+        original_flag = result.flag
 
         if original_flag in ["High", "Low", "Abnormal"]:
             EXPLICITLY_FLAGGED.add(test)
@@ -180,34 +285,14 @@ def final():
         else:
             # Only use default ranges if no valid ranges were provided
             if not low or not high or low == "N/A":
-                # Try direct match first
-                if test in DEFAULT_RANGES:
-                    range_data = DEFAULT_RANGES[test]
+                # Try direct match first, then fuzzy matching
+                matched_key = RESOLVER.resolve(test)
+                if matched_key:
+                    range_data = DEFAULT_RANGES[matched_key]
                     default_low = range_data[0]
                     default_high = range_data[1]
                 else:
-                    # Try fuzzy matching
-                    matched_key = None
-                    best_match_score = 0
-
-                    for key in DEFAULT_RANGES:
-                        # Remove common variations for matching
-                        test_clean = test.lower().replace(" ", "").replace(",", "").replace("(", "").replace(")", "")
-                        key_clean = key.lower().replace(" ", "").replace(",", "").replace("(", "").replace(")", "")
-
-                        # Check for substantial overlap
-                        if test_clean in key_clean or key_clean in test_clean:
-                            score = len(set(test_clean) & set(key_clean)) / len(set(test_clean) | set(key_clean))
-                            if score > best_match_score:
-                                matched_key = key
-                                best_match_score = score
-
-                    if matched_key and best_match_score > 0.5:  # Use threshold for good matches
-                        range_data = DEFAULT_RANGES[matched_key]
-                        default_low = range_data[0]
-                        default_high = range_data[1]
-                    else:
-                        default_low, default_high = "N/A", "N/A"
+                    default_low, default_high = "N/A", "N/A"
 
                 # Only use default ranges if they are not already set
                 if not low or low == "N/A":
@@ -216,197 +301,164 @@ def final():
                     high = str(default_high)
 
             # CRITICAL CHANGE: ALWAYS preserve original flags from the PDF
-            if original_flag:
-                # Use the flag exactly as it came from the PDF
-                flag = original_flag
-            else:
-                # Only calculate flags when no original flag exists
-                flag = "Normal"
-                try:
-                    # Handle values like "<1" or ">5"
-                    if isinstance(val, str) and (val.startswith("<") or val.startswith(">")):
-                        num = float(re.sub(r"[^\d.]", "", val))
-                        if val.startswith("<") and low and num <= float(low):
-                            flag = "Low"
-                        elif val.startswith(">") and high and num >= float(high):
-                            flag = "High"
-                        else:
-                            flag = "Normal"
-                    elif low == "Not Established" or high == "Not Established" or low == "N/A" or high == "N/A":
-                        flag = "Normal"
-                    else:
-                        obs = float(val)
-                        try:
-                            low_val = float(low)
-                            if obs < low_val:
-                                flag = "Low"
-                        except:
-                            pass
-
-                        if high and high.strip():
-                            try:
-                                high_val = float(high)
-                                if obs > high_val:
-                                    flag = "High"
-                            except:
-                                pass
-                except:
-                    # Non-numeric values handling
-                    if isinstance(val, str):
-                        if any(x in val.lower() for x in ["neg", "negative", "none", "-"]):
-                            flag = "Normal"
-                        elif any(x in val.lower() for x in ["pos", "positive", "+"]):
-                            flag = "High"
-                        elif "high" in val.lower():
-                            flag = "High"
-                        elif "low" in val.lower():
-                            flag = "Low"
-
-        # This line should be inside the loop, indented to match the rest of the loop body
-        final_rows.append({
-            "Date": row['date'],
-            "TestName": test,
-            "ObservedValue": val,
-            "Units": units,
-            "Low": low,
-            "High": high,
-            "Flag": flag
-        })
-
-    # Define sort priority function
-    def sort_priority(row):
-        flag_priority = {flag: i for i, flag in enumerate(["High", "Low", "Abnormal"])}
-        date = datetime.strptime(row["Date"], "%m/%d/%Y")
-        return flag_priority.get(row["Flag"], len(flag_priority)), row["TestName"], date
+            # and only calculate flags when no original flag exists
+            flag = original_flag or evaluate(val, low, high)
+
+        result.low, result.high, result.flag = low, high, flag
+
+    # rows carry the report they were verified from; its patient is the one
+    #   recorded when it was parsed, never one named by the form
+    with stage("results_store"):
+        owners = RESULTS.owners(list({r.report for r in final_rows if r.report}))
+    reports = defaultdict(list)
+    for r in final_rows:
+        r.patient = owners.get(r.report, "")
+        if r.patient:
+            reports[r.report, r.patient].append(r)
+    with stage("results_store"):
+        for (report, patient), rows in reports.items():
+            RESULTS.save_report(report, patient, rows)
+
+    # the stored results of the submitted reports, just-verified ones
+    #   included, come back sorted; never those of other reports of the patient
+    unsaved = [r for r in final_rows if not r.patient]
+    if history:
+        with stage("results_store"):
+            final_rows = RESULTS.history(history)
+        final_rows.extend(unsaved)
 
     # Sort rows by priority and then name
-    final_rows.sort(key=sort_priority)
-    # Helper to pull numeric values for specific tests
-    def get_numeric(test_name):
-        for r in final_rows:
-            if r["TestName"].casefold() == test_name.casefold():
-                try:
-                    return float(re.sub(r"[^0-9.\-]", "", r["ObservedValue"]))
-                except Exception:
-                    return None
-        return None
-
-
-    def get_numeric_any(*names):
-        for name in names:
-            val = get_numeric(name)
-            if val is not None:
-                return val
-        return None
-
-    triglycerides = get_numeric_any("Lipid Panel - Triglycerides", "Triglycerides")
-    hdl = get_numeric_any("HDL-C", "HDL Cholesterol")
-    insulin = get_numeric("Insulin")
-    glucose = get_numeric("Glucose")
-    a1c = get_numeric("Hemoglobin A1c")
-
-    insulin_metrics = {
-        "trig_hdl_ratio": round(triglycerides / hdl, 2) if triglycerides is not None and hdl not in [None, 0] else None,
-        "homa_ir": round((insulin * glucose) / 405, 2) if insulin is not None and glucose is not None else None,
-        "estimated_average_glucose": round(28.7 * a1c - 46.7, 2) if a1c is not None else None,
-    }
+    if not history or unsaved:
+        final_rows.sort(key=sort_key)
 
     # Return the rendered template
-    return render_template('finaltable.html.j2', rows=final_rows, year=datetime.now().year, insulin_metrics=insulin_metrics)
+    with stage("render"):
+        return render_template('finaltable.html.j2', rows=final_rows, year=datetime.now().year, insulin_metrics=insulin_metrics(final_rows))
 
 
 @app.route("/ai_summary", methods=["POST"])
 def ai_summary():
     data = request.get_json(force=True)
-    rows = data.get("rows", [])
-    metrics = data.get("insulin_metrics", {})
-
-    lab_lines = [
-        f"{r['TestName']}: {r['ObservedValue']} {r['Units']} (Low: {r['Low']}, High: {r['High']}, Flag: {r['Flag']})"
-        for r in rows
-    ]
-    metric_lines = [f"{k}: {v}" for k, v in metrics.items() if v is not None]
-
-    prompt = (
-        "Please review included lab markers and calculated values with regard to the condition of insulin resistance. "
-        "Please highlight the risk of insulin resistance based on these values, and also note any other lab findings "
-        "that may be indicative of disease or require follow-up labs and physician discussion.\n\n"
-        "Please provide a concise summary in 2-3 paragraphs.\n\n" +
-        "Insulin Metrics:\n" + "\n".join(metric_lines) + "\n\nLab Values:\n" + "\n".join(lab_lines)
-    )
+    rows, metrics = ResultSet.from_json(data.get("rows", [])), data.get("insulin_metrics", {})
+
+    key = summary_key(rows, metrics)
+    if (summary := SUMMARY_CACHE.get(key)) is not None:
+        return {"summary": summary}
 
     try:
-        response = client.models.generate_content(
-            model="gemini-2.0-flash-001",
-            contents=[prompt],
-        )
-        summary = response.text
+        summary = generate(shared_client(), build_prompt(rows, metrics))
     except Exception as e:
         summary = f"Error generating summary: {e}"
+    else:
+        SUMMARY_CACHE.put(key, summary)
 
     return {"summary": summary}
 
 
+def sse_event(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+@app.route("/ai_summary/stream", methods=["POST"])
+def ai_summary_stream():
+    """Same as /ai_summary, but sends the reply as Server-Sent Events while it is generated."""
+    data = request.get_json(force=True)
+    rows, metrics = ResultSet.from_json(data.get("rows", [])), data.get("insulin_metrics", {})
+    key = summary_key(rows, metrics)
+    cached = SUMMARY_CACHE.get(key)
+
+    def events():
+        if cached is not None:
+            yield sse_event({"text": cached})
+            yield sse_event({}, event="done")
+            return
+
+        pieces = []
+        try:
+            for text in generate_stream(shared_client(), build_prompt(rows, metrics)):
+                pieces.append(text)
+                yield sse_event({"text": text})
+        except Exception as e:
+            yield sse_event({"error": f"Error generating summary: {e}"}, event="error")
+        else:
+            SUMMARY_CACHE.put(key, "".join(pieces))
+            yield sse_event({}, event="done")
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/ai_summary/batch", methods=["POST"])
+def ai_summary_batch():
+    """Start summarizing many patients in a background job.
+
+    Takes ``items``, each with a ``patient`` label, ``rows`` and optionally
+    ``insulin_metrics`` as sent to /ai_summary. Stored patients are only
+    summarized from the command line (``batch.py``), as there is no access
+    check to put them behind.
+    """
+    data = request.get_json(force=True)
+    batch = []
+    for item in data.get("items", []):
+        patient, rows = str(item.get("patient", "")), ResultSet.from_json(item.get("rows", []))
+        if "insulin_metrics" in item:
+            batch.append(SummaryRequest(patient, rows, item["insulin_metrics"]))
+        else:
+            batch.append(request_for(patient, rows))
+    if not batch:
+        return {"error": "No items to summarize"}, 400
+    if len(batch) > BATCH_MAX_PATIENTS:
+        return {"error": f"At most {BATCH_MAX_PATIENTS} patients can be summarized at once"}, 400
+
+    def work(progress):
+        results, report = summarize_batch(
+            shared_client(), batch, SUMMARY_CACHE,
+            progress=lambda result: progress(result.patient, result.error),
+        )
+        return {"summaries": [asdict(result) for result in results], "report": report}
+
+    job_id = JOBS.submit([item.patient for item in batch], work)
+    return {"job": job_id, "status": url_for("job_status", job_id=job_id)}, 202
+
+
+@app.route("/jobs/<job_id>/summaries")
+def job_summaries(job_id):
+    job = JOBS.store.get(job_id)
+    if job is None:
+        abort(404)
+    if job["status"] != "done":
+        return redirect(url_for("job_status", job_id=job_id))
+    if not isinstance(job["result"], dict):
+        abort(404)
+    return job["result"]
+
+
 @app.route("/chart_report", methods=["POST"])
 def chart_report():
     data = request.get_json(force=True)
-    rows = data.get("rows", [])
-
-    pdf_buffer = io.BytesIO()
-    c = canvas.Canvas(pdf_buffer, pagesize=letter)
-    width, height = letter
-
-    margin_x = 40
-    margin_y = 40
-    line_height = 14
-
-    category_keywords = LAB_CATEGORIES
-
-    categorized = {heading: [] for heading in category_keywords}
-    categorized["Other Lab Markers"] = []
-
-    for r in rows:
-        name = r.get("TestName", "")
-        name_lower = name.lower()
-        category = None
-        for heading, keywords in category_keywords.items():
-            if any(kw in name_lower for kw in keywords):
-                category = heading
-                break
-        if not category:
-            category = "Other Lab Markers"
-        line = (
-            f"{name}: {r.get('ObservedValue')} {r.get('Units')} "
-            f"(Low: {r.get('Low')}, High: {r.get('High')}, Flag: {r.get('Flag')})"
-        )
-        categorized[category].append(line)
+    rows = ResultSet.from_json(data.get("rows", []))
 
-    y = height - margin_y
-    for heading, lines in categorized.items():
-        if not lines:
-            continue
-        if y < margin_y + line_height:
-            c.showPage()
-            y = height - margin_y
-        c.setFont("Helvetica-Bold", 16)
-        c.drawString(margin_x, y, heading)
-        y -= line_height
-        c.setFont("Helvetica", 12)
-        for line in lines:
-            if y < margin_y + line_height:
-                c.showPage()
-                y = height - margin_y
-                c.setFont("Helvetica", 12)
-            c.drawString(margin_x + 20, y, line)
-            y -= line_height
-        y -= line_height
-
-    c.save()
-    pdf_buffer.seek(0)
-
-    return send_file(
-        pdf_buffer,
+    key = report_key(rows, LAB_CATEGORIES)
+    if key in request.if_none_match:
+        return Response(status=304, headers={"ETag": f'"{key}"'})
+
+    if (pdf := CHART_CACHE.get(key)) is None:
+        with stage("render"):
+            pdf = render_report(rows, CATEGORY_MATCHER)
+        CHART_CACHE.put(key, pdf)
+
+    response = send_file(
+        io.BytesIO(pdf),
         mimetype="application/pdf",
         as_attachment=True,
         download_name="lab_report.pdf",
+        etag=key,
     )
+    # the same rows always produce the same PDF, but check back before reusing it
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
@@ -0,0 +1,211 @@
+"""AI summaries for many patients at once.
+
+``summarize_batch`` runs one model call per patient on a pool of
+``BATCH_CONCURRENCY`` threads. Every call still takes one of the shared
+``LLM_SLOTS``, and the default leaves half of them free for people waiting
+on ``/ai_summary``. A call that fails with a transient error (no free slot,
+a timeout, a 429 or 5xx from the model) is retried up to ``BATCH_RETRIES``
+times after an exponential backoff with jitter, starting at
+``BATCH_BACKOFF`` seconds; any other error fails that patient only.
+
+Prompts are built with ``build_compact_prompt``, which leaves out the
+results that are in range, and summaries are cached in the same
+``SummaryCache`` as ``/ai_summary``. Every batch returns a report of its
+throughput, latency percentiles, retries and how much shorter the compact
+prompts were than the full ones.
+
+From the command line, summaries of stored patients (all of them by
+default) are written as JSONL and the report to stderr::
+
+    LLM_CLIENT=fake python batch.py --output summaries.jsonl
+"""
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from argparse import ArgumentParser
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass
+from typing import Any
+
+from cache import SummaryCache
+from flags import insulin_metrics
+from labresult import LabResult
+from llm import LLM_MAX_CONCURRENCY, build_compact_prompt, build_prompt, generate, is_transient, make_client, summary_key
+from metrics import count
+from results import ResultStore
+
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', max(1, LLM_MAX_CONCURRENCY // 2)))
+BATCH_RETRIES = int(os.environ.get('BATCH_RETRIES', 3))
+BATCH_BACKOFF = float(os.environ.get('BATCH_BACKOFF', 1.0))
+BATCH_BACKOFF_MAX = float(os.environ.get('BATCH_BACKOFF_MAX', 30.0))
+BATCH_MAX_PATIENTS = int(os.environ.get('BATCH_MAX_PATIENTS', 1000))
+
+
+@dataclass
+class SummaryRequest:
+    patient: str
+    rows: list[LabResult]
+    metrics: dict[str, float | None]
+
+
+@dataclass
+class SummaryResult:
+    patient: str
+    summary: str | None = None
+    error: str | None = None
+    cached: bool = False
+    attempts: int = 0
+    # from the first attempt to the reply, including backoff
+    seconds: float = 0.0
+    prompt_chars: int = 0
+    # length the prompt of /ai_summary would have had
+    full_prompt_chars: int = 0
+
+
+def request_for(patient: str, rows: list[LabResult]) -> SummaryRequest:
+    """A request for ``rows`` with the insulin metrics derived from them."""
+    return SummaryRequest(patient, rows, insulin_metrics(rows))
+
+
+def backoff_delay(attempt: int, backoff: float = BATCH_BACKOFF, limit: float = BATCH_BACKOFF_MAX) -> float:
+    """Seconds to wait before retry ``attempt`` (from 1): doubling each time, with jitter."""
+    return min(limit, backoff * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+
+
+def summarize(
+    client, request: SummaryRequest, cache: SummaryCache | None = None,
+    retries: int = BATCH_RETRIES, backoff: float = BATCH_BACKOFF, sleep: Callable[[float], None] = time.sleep,
+) -> SummaryResult:
+    prompt = build_compact_prompt(request.rows, request.metrics)
+    result = SummaryResult(
+        request.patient, prompt_chars=len(prompt),
+        full_prompt_chars=len(build_prompt(request.rows, request.metrics)),
+    )
+    if not request.rows:
+        result.error = 'No results to summarize'
+        count('batch_summaries_total', status='error')
+        return result
+    key = summary_key(request.rows, request.metrics, compact=True)
+    if cache is not None and (summary := cache.get(key)) is not None:
+        result.summary, result.cached = summary, True
+        count('batch_summaries_total', status='cached')
+        return result
+
+    start = time.perf_counter()
+    while True:
+        result.attempts += 1
+        try:
+            result.summary = generate(client, prompt)
+        except Exception as e:
+            if result.attempts <= retries and is_transient(e):
+                sleep(backoff_delay(result.attempts, backoff))
+                continue
+            result.error = f'{type(e).__name__}: {e}'
+        break
+    result.seconds = time.perf_counter() - start
+
+    if result.error is None and cache is not None:
+        cache.put(key, result.summary)
+    count('batch_summaries_total', status='error' if result.error else 'ok')
+    return result
+
+
+def _percentile(values: list[float], p: int) -> float | None:
+    if not values:
+        return None
+    return statistics.quantiles(values, n=100, method='inclusive')[p - 1] if len(values) > 1 else values[0]
+
+
+def batch_report(results: list[SummaryResult], elapsed: float, concurrency: int) -> dict[str, Any]:
+    generated = [result.seconds for result in results if result.summary is not None and not result.cached]
+    prompt_chars = sum(result.prompt_chars for result in results)
+    full_prompt_chars = sum(result.full_prompt_chars for result in results)
+    return {
+        'patients': len(results),
+        'ok': sum(result.summary is not None for result in results),
+        'failed': sum(result.error is not None for result in results),
+        'cached': sum(result.cached for result in results),
+        'retries': sum(max(0, result.attempts - 1) for result in results),
+        'concurrency': concurrency,
+        'elapsed_s': elapsed,
+        'per_s': len(results) / elapsed if elapsed else None,
+        'p50_s': _percentile(generated, 50),
+        'p95_s': _percentile(generated, 95),
+        'p99_s': _percentile(generated, 99),
+        'max_s': max(generated, default=None),
+        'prompt_chars': prompt_chars,
+        'full_prompt_chars': full_prompt_chars,
+        'prompt_reduction': 1 - prompt_chars / full_prompt_chars if full_prompt_chars else None,
+    }
+
+
+def summarize_batch(
+    client, requests: list[SummaryRequest], cache: SummaryCache | None = None,
+    concurrency: int = BATCH_CONCURRENCY, retries: int = BATCH_RETRIES, backoff: float = BATCH_BACKOFF,
+    progress: Callable[[SummaryResult], None] = None,
+) -> tuple[list[SummaryResult], dict[str, Any]]:
+    """Summaries of ``requests`` in their order, and the report of the batch.
+
+    ``progress`` is called with each result as it finishes, on the calling
+    thread.
+    """
+    start = time.perf_counter()
+    results = [None] * len(requests)
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='batch-summary') as executor:
+        futures = {
+            executor.submit(summarize, client, request, cache, retries, backoff): i
+            for i, request in enumerate(requests)
+        }
+        for future in as_completed(futures):
+            results[futures[future]] = result = future.result()
+            if progress is not None:
+                progress(result)
+    return results, batch_report(results, time.perf_counter() - start, concurrency)
+
+
+def print_report(report: dict[str, Any]):
+    latency = (
+        f"p50={report['p50_s']:.2f}s p95={report['p95_s']:.2f}s p99={report['p99_s']:.2f}s"
+        if report['p50_s'] is not None else 'no model calls'
+    )
+    reduction = f"{report['prompt_reduction']:.0%}" if report['prompt_reduction'] is not None else '-'
+    print(
+        f"{report['ok']}/{report['patients']} summaries ({report['failed']} failed, {report['cached']} cached, "
+        f"{report['retries']} retries) in {report['elapsed_s']:.1f}s: {report['per_s'] or 0:.2f}/s, {latency}; "
+        f"prompts {report['prompt_chars']} chars, {reduction} shorter than full prompts",
+        file=sys.stderr,
+    )
+
+
+def main(argv=None):
+    parser = ArgumentParser(description='Summarize the stored results of many patients.')
+    parser.add_argument('patients', nargs='*', help='patient ids (default: every stored patient)')
+    parser.add_argument('--output', '-o', required=True, help='file to write one JSON summary per line to')
+    parser.add_argument('--concurrency', type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument('--retries', type=int, default=BATCH_RETRIES)
+    parser.add_argument('--no-cache', action='store_true', help='neither read nor write the summary cache')
+    args = parser.parse_args(argv)
+
+    store = ResultStore()
+    patients = args.patients or [patient['id'] for patient in store.patients()]
+    requests = [request_for(patient, store.latest(patient)) for patient in patients]
+    with open(args.output, 'w') as f:
+        def write(result: SummaryResult):
+            f.write(json.dumps(asdict(result)) + '\n')
+            if result.error:
+                print(f'{result.patient}: {result.error}', file=sys.stderr)
+
+        _, report = summarize_batch(
+            make_client(), requests, None if args.no_cache else SummaryCache(),
+            args.concurrency, args.retries, progress=write,
+        )
+    print_report(report)
+    return 1 if report['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
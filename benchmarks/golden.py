@@ -0,0 +1,284 @@
+"""Golden parser outputs over a fixed corpus of synthetic reports.
+
+Every case in ``CASES`` is a LabCorp-style report covering something the
+parser has to get right: "(Cont.)" headings of panels that run across pages,
+"<"/">" results set apart from their number, rows without a previous result,
+qualitative results, rows the parser drops, rows cut by the clip of the
+first page and appendix pages after the "Disclaimer" that must not be read
+as table rows. ``update`` renders each
+case to ``benchmarks/golden/<case>.pdf`` and stores what ``parse_report``
+makes of it next to it as ``<case>.json``; both are committed, so a change
+to the parser (or to reportlab) cannot quietly change the corpus.
+
+Run from the repository root::
+
+    python -m benchmarks.golden check
+    python -m benchmarks.golden bench --output before.json
+    # ... change the parser ...
+    python -m benchmarks.golden check
+    python -m benchmarks.golden bench --compare before.json
+
+``check`` fails on any case whose output differs from its golden file and
+prints the difference. ``bench`` times each case over ``--rounds`` parses
+after a warm-up and reports the min, mean, median and standard deviation
+in the manner of pytest-benchmark; it also fails if an output is wrong.
+Only run ``update`` when a change in the output is intended, and review
+the diff of the JSON files.
+"""
+import argparse
+import difflib
+import json
+import platform
+import statistics
+import sys
+import time
+from collections.abc import Callable
+from datetime import datetime, timezone
+from pathlib import Path
+
+import fitz
+
+from benchmarks.parse_bench import _commit
+from benchmarks.synthetic import LabRow, Panel, Report, random_report, render
+from formats import parse_report
+from parse import ParsedDocument
+
+GOLDEN_DIR = Path(__file__).resolve().parent / 'golden'
+
+
+def _cbc() -> Panel:
+    return Panel('CBC With Differential/Platelet', [
+        LabRow('WBC', '6.1', '', '5.8', '03/14/2023', 'x10E3/uL', '3.4-10.8'),
+        LabRow('RBC', '5.91', 'High', '5.62', '03/14/2023', 'x10E6/uL', '3.77-5.28'),
+        LabRow('Hemoglobin', '17.9', 'High', '17.1', '03/14/2023', 'g/dL', '11.1-15.9'),
+        LabRow('Hematocrit', '52.4', 'High', '50.2', '03/14/2023', '%', '34.0-46.6'),
+        LabRow('MCV', '89', '', '89', '03/14/2023', 'fL', '79-97'),
+        LabRow('Platelets', '139', 'Low', '151', '03/14/2023', 'x10E3/uL', '150-450'),
+    ])
+
+
+def _lipids() -> Panel:
+    return Panel('Lipid Panel', [
+        LabRow('Cholesterol, Total', '212', 'High', '198', '03/14/2023', 'mg/dL', '100-199'),
+        LabRow('Triglycerides', '88', '', '102', '03/14/2023', 'mg/dL', '0-149'),
+        LabRow('HDL Cholesterol', '61', '', '58', '03/14/2023', 'mg/dL', '>39'),
+        LabRow('LDL Chol Calc (NIH)', '135', 'High', '121', '03/14/2023', 'mg/dL', '0-99'),
+    ])
+
+
+def single_panel() -> tuple[Report, int]:
+    return Report([_cbc()]), 1
+
+
+def comparators() -> tuple[Report, int]:
+    return Report([Panel('Comp. Metabolic Panel (14)', [
+        LabRow('Glucose', '94', '', '88', '03/14/2023', 'mg/dL', '70-99'),
+        LabRow('eGFR', '>90', '', '>90', '03/14/2023', 'mL/min/1.73', '>59'),
+        LabRow('Bilirubin, Total', '<0.2', '', '0.3', '03/14/2023', 'mg/dL', '0.0-1.2'),
+        LabRow('C-Reactive Protein, Cardiac', '<0.3', '', '', '', 'mg/L', '0.00-3.00'),
+        LabRow('Vitamin D, 25-Hydroxy', '>150', '', '<5', '03/14/2023', 'ng/mL', '30.0-100.0'),
+    ])]), 1
+
+
+def missing_previous() -> tuple[Report, int]:
+    return Report([Panel('Thyroid Panel With TSH', [
+        LabRow('TSH', '2.140', '', '', '', 'uIU/mL', '0.450-4.500'),
+        LabRow('Thyroxine (T4)', '7.4', '', '7.9', '03/14/2023', 'ug/dL', '4.5-12.0'),
+        LabRow('T3 Uptake', '24', 'Low', '', '', '%', '24-39'),
+        LabRow('Free Thyroxine Index', '1.8', '', '', '', '', '1.2-4.9'),
+    ]), _lipids()]), 1
+
+
+def qualitative() -> tuple[Report, int]:
+    # "Urinalysis Gross Exam" and notes are dropped by the parser
+    return Report([Panel('Urinalysis, Complete', [
+        LabRow('Urinalysis Gross Exam', ''),
+        LabRow('Specific Gravity', '1.021', '', '1.018', '03/14/2023', '', '1.005-1.030'),
+        LabRow('Color', 'Yellow', '', 'Yellow', '03/14/2023', '', 'Yellow'),
+        LabRow('Appearance', 'Cloudy', 'Abnormal', 'Clear', '03/14/2023', '', 'Clear'),
+        LabRow('Protein', 'Negative', '', 'Negative', '03/14/2023', '', 'Negative/Trace'),
+        LabRow('Ketones', 'Trace', 'Abnormal', '', '', '', 'Negative'),
+        LabRow('Note: Microscopic follows if indicated', ''),
+    ])]), 1
+
+
+def continued() -> tuple[Report, int]:
+    # one long panel runs onto two more pages under "(Cont.)" headings
+    return random_report(60, seed=11, rows_per_panel=60), 1
+
+
+def multipage_panels() -> tuple[Report, int]:
+    return random_report(150, seed=7, rows_per_panel=45), 1
+
+
+def disclaimer_cutoff() -> tuple[Report, int]:
+    # the appendix pages are headed like a panel of the report, so reading
+    #   past the disclaimer would turn their text into rows
+    report = Report([_cbc(), _lipids()], appendix='Lipid Panel')
+    return report, 4
+
+
+def disclaimer_own_page() -> tuple[Report, int]:
+    # the last table fills the page and the disclaimer starts the next one
+    return random_report(21, seed=5, rows_per_panel=21), 1
+
+
+def clip_edge() -> tuple[Report, int]:
+    # page 0 is clipped to the width of the Ordered Items box, which here
+    #   ends inside the Units column: MuPDF keeps only the characters of the
+    #   units that lie inside it, and drops the reference intervals beyond
+    return Report([_cbc(), _lipids()], ordered_items_width=417), 1
+
+
+def large() -> tuple[Report, int]:
+    return random_report(500, seed=3), 1
+
+
+CASES: dict[str, Callable[[], tuple[Report, int]]] = {
+    case.__name__: case for case in [
+        single_panel, comparators, missing_previous, qualitative, continued,
+        multipage_panels, disclaimer_cutoff, disclaimer_own_page, clip_edge, large,
+    ]
+}
+
+
+def parse(data: bytes) -> dict:
+    with fitz.open(stream=data, filetype='pdf') as doc:
+        name, subject, sample, rows = parse_report(ParsedDocument(doc))
+        return {'format': name, 'pages': len(doc), 'subject': subject, 'sample': sample, 'rows': rows}
+
+
+def _paths(case: str) -> tuple[Path, Path]:
+    return GOLDEN_DIR / f'{case}.pdf', GOLDEN_DIR / f'{case}.json'
+
+
+def _dump(output: dict) -> str:
+    return json.dumps(output, indent=1, ensure_ascii=False) + '\n'
+
+
+def update(cases: list[str]):
+    GOLDEN_DIR.mkdir(exist_ok=True)
+    for case in cases:
+        report, pages = CASES[case]()
+        pdf, golden = _paths(case)
+        pdf.write_bytes(render(report, pages))
+        output = parse(pdf.read_bytes())
+        golden.write_text(_dump(output))
+        print(f"{case:<20} pages={output['pages']:<3} rows={len(output['rows']):<4} written", file=sys.stderr)
+
+
+def check(cases: list[str]) -> bool:
+    ok = True
+    for case in cases:
+        pdf, golden = _paths(case)
+        expected, actual = golden.read_text(), _dump(parse(pdf.read_bytes()))
+        if actual == expected:
+            print(f'{case:<20} ok', file=sys.stderr)
+            continue
+        ok = False
+        print(f'{case:<20} DIFFERS', file=sys.stderr)
+        diff = difflib.unified_diff(
+            expected.splitlines(), actual.splitlines(), f'{golden.name} (golden)', f'{golden.name} (parsed)', lineterm='',
+        )
+        for line in list(diff)[:60]:
+            print(f'    {line}', file=sys.stderr)
+    return ok
+
+
+def bench_case(case: str, rounds: int, warmup: int) -> dict:
+    pdf, golden = _paths(case)
+    data, expected = pdf.read_bytes(), json.loads(golden.read_text())
+
+    for _ in range(warmup):
+        parse(data)
+    timings, output = [], None
+    for _ in range(rounds):
+        # opening the document is part of what a request pays for
+        start = time.perf_counter()
+        output = parse(data)
+        timings.append(time.perf_counter() - start)
+
+    mean = statistics.mean(timings)
+    return {
+        'case': case,
+        'pages': output['pages'],
+        'rows': len(output['rows']),
+        'ok': output == expected,
+        'rounds': rounds,
+        'min_s': min(timings),
+        'max_s': max(timings),
+        'mean_s': mean,
+        'median_s': statistics.median(timings),
+        'stddev_s': statistics.stdev(timings) if rounds > 1 else 0.0,
+        'ops': 1 / mean,
+        'rows_per_s': len(output['rows']) / mean,
+    }
+
+
+def compare(results: list[dict], baseline: list[dict]):
+    before = {case['case']: case for case in baseline}
+    print(f"{'case':<20} {'before ms':>10} {'after ms':>10} {'speedup':>8}", file=sys.stderr)
+    for case in results:
+        old = before.get(case['case'])
+        if old is None:
+            continue
+        print(
+            f"{case['case']:<20} {old['median_s'] * 1000:>10.2f} {case['median_s'] * 1000:>10.2f} "
+            f"{old['median_s'] / case['median_s']:>7.2f}x",
+            file=sys.stderr,
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('command', choices=['check', 'bench', 'update'])
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--rounds', type=int, default=20, help='timed parses per case')
+    parser.add_argument('--warmup', type=int, default=2, help='untimed parses per case before the timed ones')
+    parser.add_argument('--output', help='write the bench results here instead of stdout')
+    parser.add_argument('--compare', metavar='BASELINE', help='print speedups against an earlier bench --output')
+    args = parser.parse_args(argv)
+
+    if args.command == 'update':
+        update(args.cases)
+        return 0
+    if args.command == 'check':
+        return 0 if check(args.cases) else 1
+
+    results = []
+    for case in args.cases:
+        result = bench_case(case, args.rounds, args.warmup)
+        results.append(result)
+        print(
+            f"{case:<20} pages={result['pages']:<3} rows={result['rows']:<4} "
+            f"min={result['min_s'] * 1000:8.2f}ms mean={result['mean_s'] * 1000:8.2f}ms "
+            f"median={result['median_s'] * 1000:8.2f}ms stddev={result['stddev_s'] * 1000:6.2f}ms "
+            f"ops={result['ops']:8.1f}/s{'' if result['ok'] else '  OUTPUT DIFFERS FROM GOLDEN'}",
+            file=sys.stderr,
+        )
+
+    output = {
+        'commit': _commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'pymupdf': fitz.VersionBind,
+        'rounds': args.rounds,
+        'warmup': args.warmup,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+    else:
+        json.dump(output, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)['results'])
+
+    return 0 if all(case['ok'] for case in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""Concurrent load against a running server, to compare serving modes.
+
+Start the app with the fake model, once per mode to compare::
+
+    LLM_CLIENT=fake LLM_MAX_CONCURRENCY=64 GUNICORN_THREADS=1 gunicorn app:app
+    LLM_CLIENT=fake LLM_MAX_CONCURRENCY=64 GUNICORN_THREADS=8 gunicorn app:app
+
+and run from the repository root::
+
+    python -m benchmarks.load_test --concurrency 16 --requests 64
+
+``summary`` requests post a different set of rows each time so none is
+served from the summary cache, and ``parse`` requests upload synthetic
+reports that are all distinct for the same reason. The throughput and
+latency percentiles of each kind of request are reported on stderr and as
+JSON on stdout.
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.synthetic import random_report, render
+
+
+def _summary_request(url: str, i: int) -> urllib.request.Request:
+    rows = [
+        {'TestName': 'Glucose', 'ObservedValue': str(80 + i), 'Units': 'mg/dL', 'Low': '70', 'High': '99', 'Flag': ''},
+        {'TestName': 'Insulin', 'ObservedValue': '12', 'Units': 'uIU/mL', 'Low': '2.6', 'High': '24.9', 'Flag': ''},
+    ]
+    body = json.dumps({'rows': rows, 'insulin_metrics': {'load_test': str(uuid.uuid4())}}).encode()
+    return urllib.request.Request(f'{url}/ai_summary', body, {'Content-Type': 'application/json'})
+
+
+def _parse_request(url: str, pdf: bytes) -> urllib.request.Request:
+    boundary = uuid.uuid4().hex
+    body = b''.join([
+        f'--{boundary}\r\n'.encode(),
+        b'Content-Disposition: form-data; name="file"; filename="report.pdf"\r\n',
+        b'Content-Type: application/pdf\r\n\r\n',
+        pdf,
+        f'\r\n--{boundary}--\r\n'.encode(),
+    ])
+    return urllib.request.Request(f'{url}/parse', body, {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+
+
+def _send(kind: str, request: urllib.request.Request, timeout: float) -> tuple[str, float, bool]:
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            body = response.read()
+        # the summary endpoint reports model errors, e.g. no free slot, in its reply
+        ok = kind != 'summary' or not json.loads(body)['summary'].startswith('Error')
+    except (urllib.error.URLError, OSError, ValueError):
+        ok = False
+    return kind, time.perf_counter() - start, ok
+
+
+def _percentile(values: list[float], p: float) -> float:
+    return statistics.quantiles(values, n=100, method='inclusive')[p - 1] if len(values) > 1 else values[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--kind', choices=['summary', 'parse', 'mixed'], default='mixed')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=64)
+    parser.add_argument('--rows', type=int, default=100, help='rows per uploaded report')
+    parser.add_argument('--timeout', type=float, default=120)
+    args = parser.parse_args(argv)
+
+    kinds = {'summary': ['summary'], 'parse': ['parse'], 'mixed': ['summary', 'parse']}[args.kind]
+    requests = []
+    for i in range(args.requests):
+        kind = kinds[i % len(kinds)]
+        if kind == 'summary':
+            requests.append((kind, _summary_request(args.url, i)))
+        else:
+            # every report differs, so none is served from the parse cache
+            requests.append((kind, _parse_request(args.url, render(random_report(args.rows, seed=i + int(time.time())), 1))))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        results = list(executor.map(lambda item: _send(*item, args.timeout), requests))
+    elapsed = time.perf_counter() - start
+
+    report = {'url': args.url, 'concurrency': args.concurrency, 'elapsed_s': elapsed, 'kinds': {}}
+    for kind in kinds:
+        latencies = [latency for k, latency, ok in results if k == kind and ok]
+        failed = sum(not ok for k, _, ok in results if k == kind)
+        report['kinds'][kind] = stats = {
+            'ok': len(latencies),
+            'failed': failed,
+            'per_s': len(latencies) / elapsed,
+            'p50_s': _percentile(latencies, 50) if latencies else None,
+            'p95_s': _percentile(latencies, 95) if latencies else None,
+            'p99_s': _percentile(latencies, 99) if latencies else None,
+        }
+        print(
+            f"{kind:<8} ok={stats['ok']:<4} failed={stats['failed']:<4} {stats['per_s']:6.2f}/s"
+            + (f" p50={stats['p50_s'] * 1000:.0f}ms p95={stats['p95_s'] * 1000:.0f}ms p99={stats['p99_s'] * 1000:.0f}ms" if latencies else ''),
+            file=sys.stderr,
+        )
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    return 0 if all(not stats['failed'] for stats in report['kinds'].values()) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""Time ``parse_labcorp_pdf`` over synthetic reports of increasing size.
+
+Run from the repository root::
+
+    python -m benchmarks.parse_bench --output before.json
+    # ... change the parser ...
+    python -m benchmarks.parse_bench --compare before.json
+
+Every case is a (pages, rows) pair; the report is rendered once and parsed
+``--repeat`` times, and the parsed rows are checked against the generated
+ones so a faster parser that drops rows does not pass unnoticed. Results are
+written as JSON together with the commit and library versions they were
+measured with.
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import fitz
+
+from benchmarks.synthetic import random_report, render
+from parse import ParsedDocument, parse_labcorp_pdf
+
+PAGES = [1, 5, 10, 25, 50]
+ROWS = [1, 10, 50, 100, 250, 500]
+
+
+def _commit() -> str | None:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_case(pages: int, rows: int, repeat: int, seed: int = 0) -> dict:
+    report = random_report(rows, seed=seed)
+    data = render(report, pages)
+
+    timings, parsed = [], None
+    for _ in range(repeat):
+        # opening the document is part of what a request pays for
+        start = time.perf_counter()
+        with fitz.open(stream=data, filetype='pdf') as doc:
+            document = ParsedDocument(doc)
+            _, _, parsed = parse_labcorp_pdf(document)
+            page_count, skipped = len(doc), document.skipped_pages
+        timings.append(time.perf_counter() - start)
+
+    median = statistics.median(timings)
+    return {
+        'pages': page_count,
+        'requested_pages': pages,
+        'skipped_pages': skipped,
+        'rows': report.rows,
+        'parsed_rows': len(parsed),
+        'ok': len(parsed) == report.rows,
+        'bytes': len(data),
+        'median_s': median,
+        'min_s': min(timings),
+        'per_page_ms': median / page_count * 1000,
+        'per_row_ms': median / report.rows * 1000,
+    }
+
+
+def compare(results: list[dict], baseline: list[dict]):
+    before = {(case['requested_pages'], case['rows']): case for case in baseline}
+    print(f"{'pages':>5} {'rows':>5} {'before ms':>10} {'after ms':>10} {'speedup':>8}", file=sys.stderr)
+    for case in results:
+        old = before.get((case['requested_pages'], case['rows']))
+        if old is None:
+            continue
+        print(
+            f"{case['requested_pages']:>5} {case['rows']:>5} {old['median_s'] * 1000:>10.2f} "
+            f"{case['median_s'] * 1000:>10.2f} {old['median_s'] / case['median_s']:>7.2f}x",
+            file=sys.stderr,
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, nargs='+', default=PAGES)
+    parser.add_argument('--rows', type=int, nargs='+', default=ROWS)
+    parser.add_argument('--repeat', type=int, default=5, help='parses per case; the median is reported')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON results here instead of stdout')
+    parser.add_argument('--compare', metavar='BASELINE', help='print speedups against an earlier --output')
+    args = parser.parse_args(argv)
+
+    results = []
+    for pages in args.pages:
+        for rows in args.rows:
+            case = run_case(pages, rows, args.repeat, args.seed)
+            results.append(case)
+            print(
+                f"pages={case['pages']:<3} rows={case['rows']:<4} median={case['median_s'] * 1000:8.2f}ms "
+                f"per page={case['per_page_ms']:6.2f}ms skipped={case['skipped_pages']:<3}"
+                f"{'' if case['ok'] else '  ROW COUNT MISMATCH'}",
+                file=sys.stderr,
+            )
+
+    output = {
+        'commit': _commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'pymupdf': fitz.VersionBind,
+        'repeat': args.repeat,
+        'seed': args.seed,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+    else:
+        json.dump(output, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)['results'])
+
+    return 0 if all(case['ok'] for case in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
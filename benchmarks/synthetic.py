@@ -0,0 +1,252 @@
+"""Synthetic LabCorp-style reports for exercising the parser.
+
+The layout follows what ``parse.py`` expects from a real LabCorp PDF: the
+patient name as the first block, "Key: value" patient and sample details, an
+"Ordered Items:" block naming every panel, the five column headers, one
+block per result row set in 9pt type, "(Cont.)" headings where a panel runs
+onto the next page and a "Disclaimer" after the last table. Reports can be
+padded with appendix pages after the disclaimer, as real reports often are.
+"""
+import io
+import json
+import random
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas
+
+HEADERS = ['Test', 'Current Result and Flag', 'Previous Result and Date', 'Units', 'Reference Interval']
+
+PANEL_NAMES = [
+    'CBC With Differential/Platelet',
+    'Comp. Metabolic Panel (14)',
+    'Lipid Panel',
+    'Hemoglobin A1c',
+    'Thyroid Panel With TSH',
+    'Iron and TIBC',
+    'Vitamin D, 25-Hydroxy',
+    'Urinalysis, Complete',
+]
+
+WIDTH, HEIGHT = letter
+MARGIN = 40
+ROW_HEIGHT = 24
+FONT_SIZE = 9
+# x position of each piece of a row
+X_TEST, X_RESULT, X_FLAG, X_PREVIOUS, X_PREVIOUS_DATE, X_UNITS, X_REFERENCE = 40, 230, 270, 330, 380, 440, 525
+HEADER_X = [X_TEST, X_RESULT, X_PREVIOUS, X_UNITS, X_REFERENCE]
+
+CATALOG = Path(__file__).resolve().parent.parent / 'default_ranges.json'
+
+
+@dataclass
+class LabRow:
+    test: str
+    result: str
+    flag: str = ''
+    previous_result: str = ''
+    previous_date: str = ''
+    units: str = ''
+    reference: str = ''
+
+
+@dataclass
+class Panel:
+    name: str
+    rows: list[LabRow] = field(default_factory=list)
+
+
+@dataclass
+class Report:
+    panels: list[Panel]
+    name: str = 'DOE, JANE'
+    dob: str = '04/12/1975'
+    age: str = '49'
+    sex: str = 'Female'
+    date_collected: str = '01/02/2024'
+    date_received: str = '01/02/2024'
+    date_reported: str = '01/04/2024'
+    fasting: str = 'Yes'
+    # heading of the appendix pages after the disclaimer
+    appendix: str = 'Interpretation'
+    # the Ordered Items lines are padded with spaces to this width; a
+    #   narrower box makes the parser's page-0 clip cut through table rows
+    ordered_items_width: float = WIDTH - MARGIN - 5
+
+    @property
+    def rows(self) -> int:
+        return sum(len(panel.rows) for panel in self.panels)
+
+
+def _format(value: float) -> str:
+    return f'{value:.1f}' if value < 100 else f'{value:.0f}'
+
+
+def random_row(rng: random.Random, test: str, reference: list) -> LabRow:
+    """A plausible result for ``test`` given its catalog entry."""
+    if len(reference) == 2:
+        qualitative, _ = reference
+        return LabRow(test, qualitative, reference=qualitative)
+
+    low, high, units = reference[:3]
+    # the standard PDF fonts cannot draw "μ"; LabCorp writes "u" as well
+    units = units.replace('μ', 'u')
+    interval = f'{_format(low)}-{_format(high)}' if high is not None else f'>{_format(low)}'
+    high = high if high is not None else low * 2
+    span = (high - low) or 1
+    roll = rng.random()
+    if roll < 0.15:
+        value, flag = high + span * rng.uniform(0.05, 0.5), 'High'
+    elif roll < 0.25 and low > 0:
+        value, flag = low * rng.uniform(0.5, 0.95), 'Low'
+    else:
+        value, flag = rng.uniform(low, high), ''
+    row = LabRow(test, _format(value), flag, units=units, reference=interval)
+    if roll > 0.95:
+        row.result, row.flag = f'<{_format(low or 1)}', ''
+    if rng.random() < 0.5:
+        row.previous_result = _format(rng.uniform(low, high))
+        row.previous_date = f'{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/2023'
+    return row
+
+
+def random_report(rows: int, seed: int = 0, rows_per_panel: int = 12) -> Report:
+    """A report with ``rows`` results drawn from the reference catalog."""
+    rng = random.Random(seed)
+    with open(CATALOG) as f:
+        catalog = [
+            (test, reference) for test, reference in json.load(f).items()
+            if 'note' not in test.casefold() and test.casefold() not in {'pdf', 'disclaimer'}
+            # a test named like a panel would be read as that panel's heading
+            and not any(test == name or test.startswith(f'{name} ') for name in PANEL_NAMES)
+            # LabCorp truncates names to fit the Test column
+            and stringWidth(test, 'Helvetica', FONT_SIZE) < X_RESULT - X_TEST - 10
+        ]
+
+    panels = []
+    for start in range(0, rows, rows_per_panel):
+        index = len(panels)
+        name = PANEL_NAMES[index % len(PANEL_NAMES)]
+        if index >= len(PANEL_NAMES):
+            name = f'{name} {index // len(PANEL_NAMES) + 1}'
+        count = min(rows_per_panel, rows - start)
+        panels.append(Panel(name, [random_row(rng, *rng.choice(catalog)) for _ in range(count)]))
+    return Report(panels)
+
+
+class _Writer:
+    """Lays the report out page by page, starting new pages as rows run out of room."""
+
+    def __init__(self, buffer):
+        # invariant output, so the same report always renders to the same bytes
+        self.canvas = canvas.Canvas(buffer, pagesize=letter, invariant=True)
+        self.pages = 1
+        self.y = HEIGHT - MARGIN
+
+    def text(self, x: float, text: str, font: str = 'Helvetica', size: float = FONT_SIZE):
+        if text:
+            self.canvas.setFont(font, size)
+            self.canvas.drawString(x, self.y, text)
+
+    def column_headers(self):
+        for x, header in zip(HEADER_X, HEADERS):
+            self.text(x, header, 'Helvetica-Bold', 8)
+        self.y -= 30
+
+    def new_page(self, continued: str = None):
+        self.canvas.showPage()
+        self.pages += 1
+        self.y = HEIGHT - MARGIN
+        self.column_headers()
+        if continued:
+            self.section(f'{continued} (Cont.)')
+
+    def section(self, name: str):
+        self.text(X_TEST, name, 'Helvetica-Bold', 10)
+        self.y -= ROW_HEIGHT
+
+    def row(self, row: LabRow, panel: str):
+        if self.y < MARGIN + ROW_HEIGHT:
+            self.new_page(continued=panel)
+        self.text(X_TEST, row.test)
+        if row.result[:1] in '<>' and len(row.result) > 1:
+            # LabCorp sets the comparator apart from the number
+            self.text(X_RESULT, row.result[0])
+            self.text(X_RESULT + 7, row.result[1:])
+        else:
+            self.text(X_RESULT, row.result)
+        self.text(X_FLAG, row.flag)
+        self.text(X_PREVIOUS, row.previous_result)
+        self.text(X_PREVIOUS_DATE, row.previous_date)
+        self.text(X_UNITS, row.units)
+        self.text(X_REFERENCE, row.reference)
+        self.y -= ROW_HEIGHT
+
+
+def render(report: Report, pages: int = 1) -> bytes:
+    """Draw ``report`` as a PDF of at least ``pages`` pages.
+
+    Pages beyond those the tables need are appendix pages after the
+    disclaimer.
+    """
+    buffer = io.BytesIO()
+    out = _Writer(buffer)
+
+    out.text(MARGIN, report.name, 'Helvetica-Bold', 12)
+    out.y -= 14
+    out.text(MARGIN, 'Patient Report')
+    out.y -= 26
+    out.text(300, f'DOB: {report.dob} Age: {report.age} Sex: {report.sex}')
+    out.y -= 20
+    out.text(MARGIN, (
+        f'Date Collected: {report.date_collected} Date Received: {report.date_received} '
+        f'Date Reported: {report.date_reported} Fasting: {report.fasting}'
+    ))
+    out.y -= 30
+
+    # LabCorp's "Ordered Items" box spans the page and the parser clips page 0
+    # to the area below it, so every line is padded out to the right edge;
+    # panel names are never broken across lines
+    items = [f'{panel.name};' for panel in report.panels]
+    items[-1] = items[-1].removesuffix(';')
+    line, lines, width = 'Ordered Items:', [], WIDTH - 2 * MARGIN
+    for item in items:
+        candidate = f'{line} {item}'
+        if stringWidth(candidate, 'Helvetica', FONT_SIZE) > width:
+            lines.append(line)
+            candidate = item
+        line = candidate
+    lines.append(line)
+    for line in lines:
+        while stringWidth(line + ' ', 'Helvetica', FONT_SIZE) <= report.ordered_items_width:
+            line += ' '
+        out.text(MARGIN, line)
+        out.y -= 12
+    out.y -= 20
+
+    out.column_headers()
+    for panel in report.panels:
+        if out.y < MARGIN + 2 * ROW_HEIGHT:
+            out.new_page()
+        out.section(panel.name)
+        for row in panel.rows:
+            out.row(row, panel.name)
+
+    if out.y < MARGIN + 3 * ROW_HEIGHT:
+        out.new_page()
+    out.y -= 10
+    out.text(X_TEST, 'Disclaimer', 'Helvetica-Bold', 10)
+    out.y -= ROW_HEIGHT
+    out.text(X_TEST, 'The Previous Result is listed for the most recent test performed by Labcorp in the past 3 years.')
+
+    while out.pages < pages:
+        out.new_page()
+        out.section(report.appendix)
+        for _ in range(20):
+            out.text(X_TEST, 'Results should be interpreted in the context of the clinical presentation of the patient.')
+            out.y -= 14
+
+    out.canvas.save()
+    return buffer.getvalue()
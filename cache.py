@@ -0,0 +1,227 @@
+"""SQLite-backed caches shared by every worker.
+
+``ParseCache`` is a content-addressed cache of parse results. Entries are keyed by the SHA-256 of the PDF bytes together with
+``parse.PARSER_VERSION``, so re-uploading a report that was seen before
+skips PyMuPDF entirely. Alongside the raw ``formats.parse_report`` output the
+cache keeps the normalized rows built by ``/parse``; those are tagged with
+the reference catalog they were built against and rebuilt when it changes.
+
+When it grows past ``PARSE_CACHE_MAX_BYTES`` the least recently used
+entries are evicted.
+
+``SummaryCache`` keeps generated AI summaries keyed by a fingerprint of the
+prompt inputs, so viewing the same results again does not pay for another
+model call. Entries expire after ``SUMMARY_CACHE_TTL`` seconds and only the
+``SUMMARY_CACHE_MAX_ENTRIES`` most recently used are kept.
+
+``ChartCache`` keeps rendered ``/chart_report`` PDFs keyed by
+``chart.report_key``, evicting the least recently used once they add up to
+more than ``CHART_CACHE_MAX_BYTES``. ``PreviewCache`` does the same for the
+table previews of the verification page, up to ``PREVIEW_CACHE_MAX_BYTES``.
+"""
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from metrics import count
+from parse import PARSER_VERSION
+
+PARSE_CACHE_PATH = os.environ.get('PARSE_CACHE_PATH', 'cache/parse_cache.sqlite3')
+PARSE_CACHE_MAX_BYTES = int(os.environ.get('PARSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+SUMMARY_CACHE_PATH = os.environ.get('SUMMARY_CACHE_PATH', 'cache/summary_cache.sqlite3')
+SUMMARY_CACHE_TTL = float(os.environ.get('SUMMARY_CACHE_TTL', 7 * 24 * 60 * 60))
+SUMMARY_CACHE_MAX_ENTRIES = int(os.environ.get('SUMMARY_CACHE_MAX_ENTRIES', 1000))
+CHART_CACHE_PATH = os.environ.get('CHART_CACHE_PATH', 'cache/chart_cache.sqlite3')
+CHART_CACHE_MAX_BYTES = int(os.environ.get('CHART_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+PREVIEW_CACHE_PATH = os.environ.get('PREVIEW_CACHE_PATH', 'cache/preview_cache.sqlite3')
+PREVIEW_CACHE_MAX_BYTES = int(os.environ.get('PREVIEW_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+
+@contextmanager
+def connect(path: str):
+    conn = sqlite3.connect(path, timeout=10)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def prepare(path: str, *statements: str):
+    """Create the directory, database and schema for a store at ``path``."""
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with connect(path) as conn:
+        conn.execute('PRAGMA journal_mode=WAL')
+        for statement in statements:
+            conn.execute(statement)
+
+
+@dataclass
+class CacheEntry:
+    subject_metadata: dict[str, str]
+    sample_metadata: dict[str, str]
+    rows: list[dict[str, str]]
+    # ResultSet.to_rows() of the normalized rows
+    normalized: list[list[str]] | None = None
+    catalog: str | None = None
+    # engine.ParseResult.regions, for the verification page previews
+    regions: list[list[float]] | None = None
+
+
+class ParseCache:
+    def __init__(self, path: str = PARSE_CACHE_PATH, max_bytes: int = PARSE_CACHE_MAX_BYTES, version: str = PARSER_VERSION):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.version = version
+        prepare(
+            path,
+            'CREATE TABLE IF NOT EXISTS parse_cache ('
+            '  digest TEXT NOT NULL,'
+            '  version TEXT NOT NULL,'
+            '  payload TEXT NOT NULL,'
+            '  size INTEGER NOT NULL,'
+            '  last_access REAL NOT NULL,'
+            '  PRIMARY KEY (digest, version)'
+            ')',
+            'CREATE INDEX IF NOT EXISTS parse_cache_last_access ON parse_cache (last_access)',
+        )
+
+    def get(self, digest: str) -> CacheEntry | None:
+        with connect(self.path) as conn:
+            found = conn.execute(
+                'SELECT payload FROM parse_cache WHERE digest = ? AND version = ?',
+                (digest, self.version),
+            ).fetchone()
+            count('cache_requests_total', cache='parse', result='miss' if found is None else 'hit')
+            if found is None:
+                return None
+            conn.execute(
+                'UPDATE parse_cache SET last_access = ? WHERE digest = ? AND version = ?',
+                (time.time(), digest, self.version),
+            )
+        return CacheEntry(**json.loads(found[0]))
+
+    def put(self, digest: str, entry: CacheEntry):
+        payload = json.dumps(entry.__dict__)
+        with connect(self.path) as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO parse_cache (digest, version, payload, size, last_access) VALUES (?, ?, ?, ?, ?)',
+                (digest, self.version, payload, len(payload), time.time()),
+            )
+            self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection):
+        total, = conn.execute('SELECT COALESCE(SUM(size), 0) FROM parse_cache').fetchone()
+        if total <= self.max_bytes:
+            return
+        for digest, version, size in conn.execute(
+            'SELECT digest, version, size FROM parse_cache ORDER BY last_access'
+        ).fetchall():
+            conn.execute('DELETE FROM parse_cache WHERE digest = ? AND version = ?', (digest, version))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+
+class SummaryCache:
+    def __init__(self, path: str = SUMMARY_CACHE_PATH, ttl: float = SUMMARY_CACHE_TTL, max_entries: int = SUMMARY_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        prepare(
+            path,
+            'CREATE TABLE IF NOT EXISTS summary_cache ('
+            '  key TEXT PRIMARY KEY,'
+            '  summary TEXT NOT NULL,'
+            '  created REAL NOT NULL,'
+            '  last_access REAL NOT NULL'
+            ')',
+            'CREATE INDEX IF NOT EXISTS summary_cache_last_access ON summary_cache (last_access)',
+        )
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with connect(self.path) as conn:
+            found = conn.execute(
+                'SELECT summary FROM summary_cache WHERE key = ? AND created > ?',
+                (key, now - self.ttl),
+            ).fetchone()
+            if found is not None:
+                conn.execute('UPDATE summary_cache SET last_access = ? WHERE key = ?', (now, key))
+        count('cache_requests_total', cache='summary', result='miss' if found is None else 'hit')
+        return None if found is None else found[0]
+
+    def put(self, key: str, summary: str):
+        now = time.time()
+        with connect(self.path) as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO summary_cache (key, summary, created, last_access) VALUES (?, ?, ?, ?)',
+                (key, summary, now, now),
+            )
+            conn.execute('DELETE FROM summary_cache WHERE created <= ?', (now - self.ttl,))
+            conn.execute(
+                'DELETE FROM summary_cache WHERE key NOT IN '
+                '(SELECT key FROM summary_cache ORDER BY last_access DESC LIMIT ?)',
+                (self.max_entries,),
+            )
+
+
+class BlobCache:
+    """Byte strings, such as rendered files, kept until they add up to more than ``max_bytes``.
+
+    The least recently used are evicted first. ``name`` labels the cache in
+    the metrics.
+    """
+
+    def __init__(self, name: str, path: str, max_bytes: int):
+        self.name = name
+        self.path = path
+        self.max_bytes = max_bytes
+        prepare(
+            path,
+            'CREATE TABLE IF NOT EXISTS blobs ('
+            '  key TEXT PRIMARY KEY,'
+            '  data BLOB NOT NULL,'
+            '  size INTEGER NOT NULL,'
+            '  last_access REAL NOT NULL'
+            ')',
+            'CREATE INDEX IF NOT EXISTS blobs_last_access ON blobs (last_access)',
+        )
+
+    def get(self, key: str) -> bytes | None:
+        with connect(self.path) as conn:
+            found = conn.execute('SELECT data FROM blobs WHERE key = ?', (key,)).fetchone()
+            count('cache_requests_total', cache=self.name, result='miss' if found is None else 'hit')
+            if found is None:
+                return None
+            conn.execute('UPDATE blobs SET last_access = ? WHERE key = ?', (time.time(), key))
+        return found[0]
+
+    def put(self, key: str, data: bytes):
+        with connect(self.path) as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO blobs (key, data, size, last_access) VALUES (?, ?, ?, ?)',
+                (key, data, len(data), time.time()),
+            )
+            total, = conn.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()
+            if total <= self.max_bytes:
+                return
+            for old_key, size in conn.execute('SELECT key, size FROM blobs ORDER BY last_access').fetchall():
+                conn.execute('DELETE FROM blobs WHERE key = ?', (old_key,))
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+
+class ChartCache(BlobCache):
+    def __init__(self, path: str = CHART_CACHE_PATH, max_bytes: int = CHART_CACHE_MAX_BYTES):
+        super().__init__('chart', path, max_bytes)
+
+
+class PreviewCache(BlobCache):
+    def __init__(self, path: str = PREVIEW_CACHE_PATH, max_bytes: int = PREVIEW_CACHE_MAX_BYTES):
+        super().__init__('preview', path, max_bytes)
@@ -0,0 +1,97 @@
+"""The reference catalog, compiled once and loaded from a pickle.
+
+``default_ranges.json``, ``common_aliases.json`` and ``lab_categories.json``
+are parsed, and the fuzzy-matching index of ``TestNameResolver`` built, only
+when one of them changes. The result is pickled to ``CATALOG_PATH`` together
+with a digest of each source file; every later start reads the three files
+just to hash them and unpickles the compiled catalog.
+
+The source files are found next to this module, not in the working
+directory. ``python catalog.py`` compiles the catalog ahead of time, e.g.
+while building the image. Under gunicorn with ``preload_app`` it is loaded
+once in the master and shared copy-on-write by every worker.
+"""
+import hashlib
+import json
+import os
+import pickle
+import sys
+import tempfile
+from dataclasses import dataclass
+
+from resolver import TestNameResolver
+
+CATALOG_PATH = os.environ.get('CATALOG_PATH', 'cache/catalog.pickle')
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SOURCES = {
+    'ranges': 'default_ranges.json',
+    'aliases': 'common_aliases.json',
+    'categories': 'lab_categories.json',
+}
+
+# Bump when Catalog or TestNameResolver change shape so old pickles are rebuilt.
+FORMAT_VERSION = '1'
+
+
+@dataclass(frozen=True)
+class Catalog:
+    ranges: dict[str, list]
+    aliases: dict[str, str]
+    categories: dict[str, list[str]]
+    resolver: TestNameResolver
+    # SHA-256 of each source file the catalog was compiled from
+    digests: dict[str, str]
+
+
+def _read_sources(directory: str) -> dict[str, bytes]:
+    sources = {}
+    for name, filename in SOURCES.items():
+        with open(os.path.join(directory, filename), 'rb') as f:
+            sources[name] = f.read()
+    return sources
+
+
+def compile_catalog(sources: dict[str, bytes]) -> Catalog:
+    ranges, aliases, categories = (json.loads(sources[name]) for name in SOURCES)
+    return Catalog(
+        ranges, aliases, categories, TestNameResolver(ranges, aliases),
+        {name: hashlib.sha256(data).hexdigest() for name, data in sources.items()},
+    )
+
+
+def _write(catalog: Catalog, path: str):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with tempfile.NamedTemporaryFile('wb', dir=os.path.dirname(path) or '.', suffix='.tmp', delete=False) as f:
+        # a plain dict, so the pickle loads the same when this file runs as __main__
+        pickle.dump({'format': FORMAT_VERSION, **catalog.__dict__}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f.name, path)
+
+
+def load(path: str = CATALOG_PATH, directory: str = HERE) -> Catalog:
+    """The compiled catalog, rebuilt and saved first if the sources changed."""
+    sources = _read_sources(directory)
+    digests = {name: hashlib.sha256(data).hexdigest() for name, data in sources.items()}
+    try:
+        with open(path, 'rb') as f:
+            saved = pickle.load(f)
+        if saved.pop('format') == FORMAT_VERSION and saved['digests'] == digests:
+            return Catalog(**saved)
+    except (OSError, pickle.UnpicklingError, AttributeError, EOFError, KeyError, TypeError):
+        pass
+
+    catalog = compile_catalog(sources)
+    try:
+        _write(catalog, path)
+    except OSError as e:
+        # a read-only deployment still works, it just compiles on every start
+        print(f'could not save the compiled catalog to {path}: {e}', file=sys.stderr)
+    return catalog
+
+
+CATALOG = load()
+
+
+if __name__ == '__main__':
+    print(f'{CATALOG_PATH}: {len(CATALOG.ranges)} tests, {len(CATALOG.aliases)} aliases, {len(CATALOG.categories)} categories')
@@ -0,0 +1,92 @@
+"""The downloadable PDF chart of the final results.
+
+Rows are grouped under the headings of ``lab_categories.json``: a row goes
+under the first heading with a keyword contained in its test name, or under
+"Other Lab Markers". ``CategoryMatcher`` compiles each heading's keywords
+into one regular expression up front and remembers the heading of every test
+name it has seen, so grouping a report is a dictionary lookup per row.
+
+Rendered reports are cached by ``report_key``, a digest of everything that
+ends up in the PDF, which also serves as its ETag.
+"""
+import hashlib
+import io
+import json
+import re
+from functools import lru_cache
+
+from labresult import LabResult
+
+# Bump whenever the layout of render_report changes so cached PDFs are not reused.
+CHART_VERSION = '1'
+CHART_FIELDS = ('test', 'value', 'units', 'low', 'high', 'flag')
+OTHER_CATEGORY = 'Other Lab Markers'
+
+
+class CategoryMatcher:
+    def __init__(self, categories: dict[str, list[str]], cache_size: int = 4096):
+        self.headings = [*categories, OTHER_CATEGORY]
+        self._patterns = [
+            (heading, re.compile('|'.join(map(re.escape, keywords))))
+            for heading, keywords in categories.items() if keywords
+        ]
+        self.category = lru_cache(maxsize=cache_size)(self._category)
+
+    def _category(self, name: str) -> str:
+        name_lower = name.lower()
+        for heading, pattern in self._patterns:
+            if pattern.search(name_lower):
+                return heading
+        return OTHER_CATEGORY
+
+
+def report_key(rows: list[LabResult], categories: dict[str, list[str]]) -> str:
+    canonical = {
+        'rows': [[getattr(r, k) for k in CHART_FIELDS] for r in rows],
+        'categories': categories,
+        'chart': CHART_VERSION,
+    }
+    return hashlib.sha256(json.dumps(canonical).encode()).hexdigest()
+
+
+def render_report(rows: list[LabResult], matcher: CategoryMatcher) -> bytes:
+    # reportlab is only needed here; importing it lazily keeps worker startup fast
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    pdf_buffer = io.BytesIO()
+    c = canvas.Canvas(pdf_buffer, pagesize=letter)
+    width, height = letter
+
+    margin_x = 40
+    margin_y = 40
+    line_height = 14
+
+    categorized = {heading: [] for heading in matcher.headings}
+
+    for r in rows:
+        line = f"{r.test}: {r.value} {r.units} (Low: {r.low}, High: {r.high}, Flag: {r.flag})"
+        categorized[matcher.category(r.test)].append(line)
+
+    y = height - margin_y
+    for heading, lines in categorized.items():
+        if not lines:
+            continue
+        if y < margin_y + line_height:
+            c.showPage()
+            y = height - margin_y
+        c.setFont("Helvetica-Bold", 16)
+        c.drawString(margin_x, y, heading)
+        y -= line_height
+        c.setFont("Helvetica", 12)
+        for line in lines:
+            if y < margin_y + line_height:
+                c.showPage()
+                y = height - margin_y
+                c.setFont("Helvetica", 12)
+            c.drawString(margin_x + 20, y, line)
+            y -= line_height
+        y -= line_height
+
+    c.save()
+    return pdf_buffer.getvalue()
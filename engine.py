@@ -0,0 +1,182 @@
+"""Parse uploaded PDFs across a pool of worker processes.
+
+PyMuPDF parsing is CPU-bound and holds the GIL, so a batch of reports is
+fanned out to separate processes. Every document is isolated: a PDF that
+raises, hangs or crashes its worker produces a ``ParseResult`` with an
+``error`` instead of failing the whole batch. The pool is shared by the
+request threads of a web worker, and the workers are started by a
+``forkserver`` so they never inherit a lock from one of those threads.
+
+Configuration comes from the environment:
+
+``PARSE_WORKERS``
+    number of worker processes (``0`` parses in-process, with no timeout and
+    no isolation from a PDF that crashes the parser)
+``PARSE_TIMEOUT``
+    seconds to wait for any single document before giving up on it
+``PARSE_INLINE``
+    ``1`` parses a lone document in the calling process, which saves sending
+    it to the pool but gives up the timeout and the isolation; ``0`` (the
+    default) sends every document to the pool
+"""
+import multiprocessing
+import os
+import threading
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from multiprocessing import TimeoutError
+from multiprocessing.pool import Pool
+
+import fitz
+
+from formats import parse_report
+from metrics import collect, count, merge_stages, stage
+from parse import ParsedDocument
+
+PARSE_WORKERS = int(os.environ.get('PARSE_WORKERS', min(4, os.cpu_count() or 1)))
+PARSE_TIMEOUT = float(os.environ.get('PARSE_TIMEOUT', 30))
+PARSE_INLINE = os.environ.get('PARSE_INLINE', '0') == '1'
+
+
+# a PDF on disk, or its bytes
+Source = str | bytes
+
+
+@dataclass
+class ParseResult:
+    path: str | None
+    subject_metadata: dict[str, str] = field(default_factory=dict)
+    sample_metadata: dict[str, str] = field(default_factory=dict)
+    rows: list[dict[str, str]] = field(default_factory=list)
+    error: str | None = None
+    pages: int = 0
+    # pages the parser could tell held no results without extracting them
+    skipped_pages: int = 0
+    # seconds spent in each stage, see metrics.stage
+    timings: dict[str, float] = field(default_factory=dict)
+    # the formats.FORMATS entry the document was parsed as
+    format: str | None = None
+    # [page, x0, y0, x1, y1] of the table on each page that has one
+    regions: list[list[float]] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def open_source(source: Source) -> fitz.Document:
+    if isinstance(source, bytes):
+        return fitz.open(stream=source, filetype='pdf')
+    return fitz.open(source)
+
+
+def _parse_isolated(source: Source) -> ParseResult:
+    path = source if isinstance(source, str) else None
+    with collect() as timings:
+        try:
+            with stage('open'):
+                doc = open_source(source)
+            with doc, stage('parse'):
+                parsed = ParsedDocument(doc)
+                lab_format, subject_metadata, sample_metadata, rows = parse_report(parsed)
+                pages, skipped_pages = len(doc), parsed.skipped_pages
+                regions = [[number, *bbox] for number, bbox in sorted(parsed.table_regions.items())]
+        except Exception as e:
+            return ParseResult(path, error=f'{type(e).__name__}: {e}', timings=timings)
+    return ParseResult(path, subject_metadata, sample_metadata, rows, None, pages, skipped_pages, timings, lab_format, regions)
+
+
+def _record(result: ParseResult) -> ParseResult:
+    count('documents_total', status='ok' if result.ok else 'error', format=result.format or 'unknown')
+    count('pages_total', result.pages)
+    count('pages_skipped_total', result.skipped_pages)
+    count('rows_total', len(result.rows))
+    return result
+
+
+# Workers are forked from a server process that has only imported this
+#   module, not from the threaded web worker: a fork copies locks other
+#   threads hold, and a child that needs one of them hangs.
+_context = multiprocessing.get_context('forkserver')
+_context.set_forkserver_preload([__name__])
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# how often a caller waiting on a document checks whether the pool was replaced
+_POLL_INTERVAL = 0.5
+
+
+def _get_pool(workers: int) -> Pool:
+    global _pool
+    if _pool is None:
+        _pool = _context.Pool(processes=workers)
+    return _pool
+
+
+def _reset_pool():
+    """Kill every worker; used when a document hung or took its worker down."""
+    global _pool
+    if _pool is not None:
+        _pool.terminate()
+        _pool.join()
+        _pool = None
+
+
+def iter_parse(sources: list[Source], workers: int = None, timeout: float = None) -> Iterator[ParseResult]:
+    """Parse ``sources`` in parallel, yielding one result per source in input order as each finishes.
+
+    The pool is shared by every caller in the process. A caller whose
+    document hangs replaces it; the other callers notice, and send their
+    unfinished documents to the new pool instead of timing out on them.
+    """
+    workers = PARSE_WORKERS if workers is None else workers
+    timeout = PARSE_TIMEOUT if timeout is None else timeout
+
+    if workers <= 0 or (PARSE_INLINE and len(sources) <= 1):
+        for source in sources:
+            yield _record(_parse_isolated(source))
+        return
+
+    def resubmit(start: int):
+        for j in range(start, len(sources)):
+            if not pending[j].ready():
+                pending[j] = pool.apply_async(_parse_isolated, (sources[j],))
+
+    with _pool_lock:
+        pool = _get_pool(workers)
+        pending = [pool.apply_async(_parse_isolated, (source,)) for source in sources]
+    for i, source in enumerate(sources):
+        path = source if isinstance(source, str) else None
+        deadline = time.monotonic() + timeout
+        result = None
+        while result is None:
+            try:
+                result = pending[i].get(timeout=max(0, min(_POLL_INTERVAL, deadline - time.monotonic())))
+            except TimeoutError:
+                with _pool_lock:
+                    if time.monotonic() >= deadline:
+                        result = ParseResult(path, error=f'Timed out after {timeout:g}s')
+                        # the hung document still holds its worker, and the
+                        #   documents queued behind it would time out in turn
+                        if _pool is pool:
+                            _reset_pool()
+                        pool = _get_pool(workers)
+                        resubmit(i + 1)
+                    elif _pool is not pool:
+                        # another caller replaced the pool, killing this
+                        #   document along with its own: start it again
+                        pool = _get_pool(workers)
+                        resubmit(i)
+                        deadline = time.monotonic() + timeout
+            except Exception as e:
+                result = ParseResult(path, error=f'{type(e).__name__}: {e}')
+        # the worker process timed the stages into its own registry
+        merge_stages(result.timings)
+        yield _record(result)
+
+
+def parse_many(sources: list[Source], workers: int = None, timeout: float = None) -> list[ParseResult]:
+    """Parse ``sources`` in parallel, returning one result per source in input order."""
+    return list(iter_parse(sources, workers, timeout))
@@ -0,0 +1,145 @@
+"""Flag evaluation and derived metrics for the final results table.
+
+Reference ranges and observed values arrive as strings. Each distinct string
+is parsed once into a ``ReferenceRange`` or ``Observation`` (bounds as floats,
+the comparator of values like "<1" or ">5", and a fallback flag for
+qualitative values), so flagging a row is a few comparisons even when a
+request holds thousands of rows with the same ranges.
+
+``insulin_metrics`` finds the tests it needs through a name index built in one
+pass over the sorted results rather than scanning them once per test.
+"""
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from functools import lru_cache
+
+from labresult import LabResult
+
+FLAG_PRIORITY = {flag: i for i, flag in enumerate(["High", "Low", "Abnormal"])}
+NOT_ESTABLISHED = {"Not Established", "N/A"}
+
+_COMPARATOR_DIGITS = re.compile(r"[^\d.]")
+_SIGNED_DIGITS = re.compile(r"[^0-9.\-]")
+
+
+def _number(text: str) -> float | None:
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def _text_flag(val: str) -> str:
+    """Flag for a result that is not a number, e.g. "Negative" or "Positive"."""
+    val = val.lower()
+    if any(x in val for x in ["neg", "negative", "none", "-"]):
+        return "Normal"
+    if any(x in val for x in ["pos", "positive", "+"]):
+        return "High"
+    if "high" in val:
+        return "High"
+    if "low" in val:
+        return "Low"
+    return "Normal"
+
+
+@dataclass(frozen=True, slots=True)
+class ReferenceRange:
+    low: str
+    high: str
+    low_value: float | None
+    high_value: float | None
+    established: bool
+
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def compile(low: str, high: str) -> 'ReferenceRange':
+        return ReferenceRange(
+            low, high, _number(low), _number(high),
+            established=low not in NOT_ESTABLISHED and high not in NOT_ESTABLISHED,
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class Observation:
+    text: str
+    # "<" or ">" for results reported as beyond a limit, "" otherwise
+    comparator: str
+    value: float | None
+    text_flag: str
+
+    @staticmethod
+    @lru_cache(maxsize=16384)
+    def compile(val: str) -> 'Observation':
+        comparator = val[:1] if val.startswith(("<", ">")) else ""
+        value = _number(_COMPARATOR_DIGITS.sub("", val)) if comparator else _number(val)
+        return Observation(val, comparator, value, _text_flag(val))
+
+
+def evaluate(val: str, low: str, high: str) -> str:
+    """Flag ``val`` against ``low``/``high`` when the report did not flag it."""
+    obs, ref = Observation.compile(val), ReferenceRange.compile(low, high)
+
+    if obs.comparator:
+        if obs.value is None:
+            return obs.text_flag
+        if obs.comparator == "<" and ref.low:
+            if ref.low_value is None:
+                return obs.text_flag
+            return "Low" if obs.value <= ref.low_value else "Normal"
+        if obs.comparator == ">" and ref.high:
+            if ref.high_value is None:
+                return obs.text_flag
+            return "High" if obs.value >= ref.high_value else "Normal"
+        return "Normal"
+
+    if not ref.established:
+        return "Normal"
+    if obs.value is None:
+        return obs.text_flag
+    flag = "Normal"
+    if ref.low_value is not None and obs.value < ref.low_value:
+        flag = "Low"
+    if ref.high_value is not None and obs.value > ref.high_value:
+        flag = "High"
+    return flag
+
+
+@lru_cache(maxsize=4096)
+def _date(date: str) -> datetime:
+    return datetime.strptime(date, "%m/%d/%Y")
+
+
+def sort_key(result: LabResult):
+    """Flagged results first, then by test name and date."""
+    return FLAG_PRIORITY.get(result.flag, len(FLAG_PRIORITY)), result.test, _date(result.date)
+
+
+def _numeric(result: LabResult) -> float | None:
+    return _number(_SIGNED_DIGITS.sub("", result.value))
+
+
+def insulin_metrics(results: list[LabResult]) -> dict[str, float | None]:
+    """Insulin resistance measures from the first result of each test in ``results``."""
+    first = {}
+    for result in results:
+        first.setdefault(result.test.casefold(), result)
+
+    def get_numeric(*names):
+        for name in names:
+            if (result := first.get(name.casefold())) is not None and (value := _numeric(result)) is not None:
+                return value
+        return None
+
+    triglycerides = get_numeric("Lipid Panel - Triglycerides", "Triglycerides")
+    hdl = get_numeric("HDL-C", "HDL Cholesterol")
+    insulin = get_numeric("Insulin")
+    glucose = get_numeric("Glucose")
+    a1c = get_numeric("Hemoglobin A1c")
+
+    return {
+        "trig_hdl_ratio": round(triglycerides / hdl, 2) if triglycerides is not None and hdl not in [None, 0] else None,
+        "homa_ir": round((insulin * glucose) / 405, 2) if insulin is not None and glucose is not None else None,
+        "estimated_average_glucose": round(28.7 * a1c - 46.7, 2) if a1c is not None else None,
+    }
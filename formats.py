@@ -0,0 +1,73 @@
+"""Registry of the lab report layouts that can be parsed.
+
+Every format registers a ``detect`` check run on the first page of a
+document and a ``parse`` function for the whole document. Checks only look
+at the plain text of page 0, which the parser extracts anyway, so a PDF from
+an unknown lab is turned away after one page instead of failing somewhere
+in a full table extraction. Whatever the format, ``parse_report`` returns
+rows with exactly ``ROW_FIELDS``, the schema ``normalize_rows`` expects.
+
+A new layout is added with::
+
+    register('quest', detect=is_quest_report, parse=parse_quest_pdf)
+"""
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from fitz import Document
+
+from parse import ParsedDocument, ParsedPage, as_parsed_document, is_labcorp_report, parse_labcorp_pdf
+
+ROW_FIELDS = ('Test', 'Units', 'Reference Interval', 'Current Result', 'Flag', 'Previous Result', 'Date', 'Panel')
+
+Parsed = tuple[dict[str, str], dict[str, str], list[dict[str, str]]]
+
+
+class UnsupportedFormatError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class LabFormat:
+    name: str
+    detect: Callable[[ParsedPage], bool]
+    parse: Callable[[ParsedDocument], Parsed]
+
+
+# tried in registration order
+FORMATS: dict[str, LabFormat] = {}
+
+
+def register(name: str, detect: Callable[[ParsedPage], bool], parse: Callable[[ParsedDocument], Parsed]):
+    FORMATS[name] = LabFormat(name, detect, parse)
+
+
+register('labcorp', detect=is_labcorp_report, parse=parse_labcorp_pdf)
+
+
+def detect_format(doc: Document | ParsedDocument) -> LabFormat:
+    doc = as_parsed_document(doc)
+    if not len(doc):
+        raise UnsupportedFormatError('The PDF has no pages')
+    first = doc[0]
+    for lab_format in FORMATS.values():
+        if lab_format.detect(first):
+            return lab_format
+    if not first.text.strip():
+        raise UnsupportedFormatError('The first page has no text; scanned reports are not supported')
+    raise UnsupportedFormatError(f'Not a known lab report layout (supported: {", ".join(FORMATS)})')
+
+
+def _conform(rows: list[dict[str, str]]) -> list[dict[str, str]]:
+    fields = set(ROW_FIELDS)
+    if all(row.keys() == fields for row in rows):
+        return rows
+    return [{field: row.get(field, '') for field in ROW_FIELDS} for row in rows]
+
+
+def parse_report(doc: Document | ParsedDocument) -> tuple[str, dict[str, str], dict[str, str], list[dict[str, str]]]:
+    """Detect the layout of ``doc`` and parse it; returns the format name, metadata and rows."""
+    doc = as_parsed_document(doc)
+    lab_format = detect_format(doc)
+    subject_metadata, sample_metadata, rows = lab_format.parse(doc)
+    return lab_format.name, subject_metadata, sample_metadata, _conform(rows)
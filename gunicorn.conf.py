@@ -0,0 +1,27 @@
+"""Gunicorn settings; gunicorn reads this file when started from this directory.
+
+``GUNICORN_WORKERS`` processes each serve ``GUNICORN_THREADS`` requests at
+once. With more than one thread the ``gthread`` worker is used: a request
+waiting on the model, an upload or SQLite releases the GIL and leaves the
+other threads of its worker free, while PDF parsing runs in the ``engine``
+process pool. ``GUNICORN_THREADS=1`` gives the plain sync worker.
+"""
+import gc
+import os
+
+workers = int(os.environ.get('GUNICORN_WORKERS', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+worker_class = 'gthread' if threads > 1 else 'sync'
+# a streamed summary keeps its thread busy for up to LLM_TIMEOUT seconds
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+
+# Import the app, and with it PyMuPDF and the compiled reference catalog, once
+# in the master. Workers are forked from it and share those pages copy-on-write
+# instead of each importing and loading them again.
+preload_app = True
+
+
+def when_ready(server):
+    # Objects the garbage collector never visits are never written to, so the
+    # preloaded pages stay shared instead of being copied into every worker.
+    gc.freeze()
@@ -0,0 +1,197 @@
+"""Bulk ingestion of LabCorp PDFs from the command line.
+
+Walks the given files and directories for PDFs, parses them across the
+``engine`` process pool, normalizes every row exactly as ``/parse`` does and
+appends one record per row to a JSONL or CSV file::
+
+    python ingest.py archive/ --output results.jsonl
+
+Every finished document is recorded in a checkpoint file next to the output
+(``results.jsonl.checkpoint``) after its rows have been flushed to disk, so
+running the same command again after a crash or interrupt carries on with the
+documents that were not done yet. A document that was being written when the
+process died may have its rows written twice. Documents that cannot be parsed
+or time out are reported but not checkpointed, so the next run tries them
+again.
+
+Progress and the final throughput (documents, pages and rows per second) are
+reported on stderr.
+"""
+import csv
+import json
+import os
+import sys
+import time
+from argparse import ArgumentParser
+from collections.abc import Iterator
+
+from engine import PARSE_TIMEOUT, PARSE_WORKERS, iter_parse
+from normalize import normalize_rows
+from results import patient_key
+
+FIELDS = [
+    'File', 'Patient', 'Name', 'DOB', 'Date Collected',
+    'Original', 'Standardized', 'Value', 'Units', 'Low', 'High', 'Qualitative', 'Flag',
+]
+
+
+def find_pdfs(paths: list[str]) -> Iterator[str]:
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith('.pdf'):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def records(path: str, subject_metadata: dict, sample_metadata: dict, rows: list[dict]) -> list[dict[str, str]]:
+    """The output records of one document, normalized the same way as ``/parse``."""
+    if 'Date Collected' not in sample_metadata:
+        raise ValueError('Could not find "Date Collected"')
+    name = subject_metadata.get('Name', [''])
+    document = {
+        'File': path,
+        'Patient': patient_key(subject_metadata),
+        'Name': name[0] if isinstance(name, list) else name,
+        'DOB': subject_metadata.get('DOB', ''),
+        'Date Collected': sample_metadata['Date Collected'],
+    }
+    return [
+        {
+            **document,
+            'Original': result.original,
+            'Standardized': result.test,
+            'Value': result.value,
+            'Units': result.units,
+            'Low': result.low,
+            'High': result.high,
+            'Qualitative': result.qualitative,
+            'Flag': result.flag,
+        }
+        for result in normalize_rows(rows)
+    ]
+
+
+class JSONLWriter:
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, records: list[dict[str, str]]):
+        for record in records:
+            self.f.write(json.dumps(record) + '\n')
+
+
+class CSVWriter:
+    def __init__(self, f):
+        self.writer = csv.DictWriter(f, fieldnames=FIELDS)
+        if f.tell() == 0:
+            self.writer.writeheader()
+
+    def write(self, records: list[dict[str, str]]):
+        self.writer.writerows(records)
+
+
+WRITERS = {'jsonl': JSONLWriter, 'csv': CSVWriter}
+
+
+class Checkpoint:
+    """Append-only list of the documents whose rows have been written."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.done = {line.rstrip('\n') for line in f if line.strip()}
+        self.f = open(path, 'a')
+
+    def mark(self, path: str):
+        self.f.write(path + '\n')
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def close(self):
+        self.f.close()
+
+
+class Throughput:
+    def __init__(self, every: float = 5.0):
+        self.start = time.perf_counter()
+        self.every = every
+        self.last_report = self.start
+        self.docs = self.pages = self.skipped_pages = self.rows = self.errors = 0
+
+    def add(self, pages: int, skipped_pages: int, rows: int, error: bool = False):
+        self.docs += 1
+        self.pages += pages
+        self.skipped_pages += skipped_pages
+        self.rows += rows
+        self.errors += error
+        if time.perf_counter() - self.last_report >= self.every:
+            self.last_report = time.perf_counter()
+            self.report()
+
+    def report(self, total: int = None):
+        elapsed = time.perf_counter() - self.start
+        done = f'{self.docs}/{total}' if total is not None else f'{self.docs}'
+        print(
+            f'{done} documents ({self.errors} failed), {self.pages} pages ({self.skipped_pages} skipped), '
+            f'{self.rows} rows in {elapsed:.1f}s: '
+            f'{self.docs / elapsed:.1f} docs/s, {self.pages / elapsed:.1f} pages/s, {self.rows / elapsed:.0f} rows/s',
+            file=sys.stderr,
+        )
+
+
+def main(argv=None):
+    parser = ArgumentParser(description='Parse and normalize LabCorp PDFs in bulk.')
+    parser.add_argument('paths', nargs='+', help='PDF files, or directories to search for them')
+    parser.add_argument('--output', '-o', required=True, help='file to append the normalized rows to')
+    parser.add_argument('--format', choices=WRITERS, help='output format (default: from the output extension)')
+    parser.add_argument('--checkpoint', help='default: the output path with ".checkpoint" appended')
+    parser.add_argument('--workers', type=int, default=PARSE_WORKERS, help='0 parses in this process, without --timeout')
+    parser.add_argument('--timeout', type=float, help=f'seconds allowed per document (default: {PARSE_TIMEOUT:g})')
+    args = parser.parse_args(argv)
+    if args.workers <= 0 and args.timeout is not None:
+        parser.error('--timeout needs at least one worker process')
+
+    output_format = args.format or os.path.splitext(args.output)[1].lstrip('.').lower()
+    if output_format not in WRITERS:
+        parser.error(f'cannot tell the format of {args.output}, pass --format')
+
+    checkpoint = Checkpoint(args.checkpoint or f'{args.output}.checkpoint')
+    pending = [path for path in find_pdfs(args.paths) if path not in checkpoint.done]
+    if skipped := len(checkpoint.done):
+        print(f'resuming: {skipped} documents already done', file=sys.stderr)
+
+    stats = Throughput()
+    with open(args.output, 'a', newline='') as f:
+        writer = WRITERS[output_format](f)
+        try:
+            for path, result in zip(pending, iter_parse(pending, args.workers, args.timeout)):
+                error = result.error
+                rows = []
+                if error is None:
+                    try:
+                        rows = records(path, result.subject_metadata, result.sample_metadata, result.rows)
+                    except Exception as e:
+                        error = f'{type(e).__name__}: {e}'
+                if error is not None:
+                    print(f'{path}: {error}', file=sys.stderr)
+                else:
+                    writer.write(rows)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    checkpoint.mark(path)
+                stats.add(result.pages, result.skipped_pages, len(rows), error is not None)
+        finally:
+            checkpoint.close()
+            stats.report(len(pending))
+
+    return 1 if stats.errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""Background jobs for parsing uploads and batch summaries.
+
+Large batches can take longer to parse than a request is allowed to run, so
+the upload page can hand its files to a job instead: ``/parse`` returns a job
+id straight away, the work runs on a thread pool in the worker that accepted
+the upload, and the page polls ``/jobs/<id>`` for per-document progress.
+``/ai_summary/batch`` runs the same way, with one entry per patient in place
+of the documents.
+
+Job state lives in SQLite so a poll served by any gunicorn worker sees it.
+Results are kept until the user finishes verification, or for ``JOB_TTL``
+seconds if they never do.
+"""
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from cache import connect, prepare
+
+JOB_DB_PATH = os.environ.get('JOB_DB_PATH', 'cache/jobs.sqlite3')
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_TTL = float(os.environ.get('JOB_TTL', 24 * 60 * 60))
+
+
+class JobStore:
+    def __init__(self, path: str = JOB_DB_PATH, ttl: float = JOB_TTL):
+        self.path = path
+        self.ttl = ttl
+        prepare(
+            path,
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            '  id TEXT PRIMARY KEY,'
+            '  status TEXT NOT NULL,'
+            '  documents TEXT NOT NULL,'
+            '  result TEXT,'
+            '  error TEXT,'
+            '  updated REAL NOT NULL'
+            ')',
+        )
+
+    def create(self, filenames: list[str]) -> str:
+        job_id = uuid.uuid4().hex
+        documents = [{'filename': filename, 'status': 'pending', 'error': None} for filename in filenames]
+        with connect(self.path) as conn:
+            conn.execute('DELETE FROM jobs WHERE updated < ?', (time.time() - self.ttl,))
+            conn.execute(
+                'INSERT INTO jobs (id, status, documents, updated) VALUES (?, ?, ?, ?)',
+                (job_id, 'running', json.dumps(documents), time.time()),
+            )
+        return job_id
+
+    def progress(self, job_id: str, filename: str, error: str | None):
+        """Mark the first pending document called ``filename`` as finished."""
+        with connect(self.path) as conn:
+            documents = json.loads(conn.execute('SELECT documents FROM jobs WHERE id = ?', (job_id,)).fetchone()[0])
+            for document in documents:
+                if document['filename'] == filename and document['status'] == 'pending':
+                    document.update(status='error' if error else 'done', error=error)
+                    break
+            conn.execute(
+                'UPDATE jobs SET documents = ?, updated = ? WHERE id = ?',
+                (json.dumps(documents), time.time(), job_id),
+            )
+
+    def finish(self, job_id: str, result: Any):
+        with connect(self.path) as conn:
+            conn.execute(
+                'UPDATE jobs SET status = ?, result = ?, updated = ? WHERE id = ?',
+                ('done', json.dumps(result), time.time(), job_id),
+            )
+
+    def fail(self, job_id: str, error: str):
+        with connect(self.path) as conn:
+            conn.execute(
+                'UPDATE jobs SET status = ?, error = ?, updated = ? WHERE id = ?',
+                ('failed', error, time.time(), job_id),
+            )
+
+    def get(self, job_id: str) -> dict[str, Any] | None:
+        with connect(self.path) as conn:
+            found = conn.execute(
+                'SELECT status, documents, result, error FROM jobs WHERE id = ? AND updated >= ?',
+                (job_id, time.time() - self.ttl),
+            ).fetchone()
+        if found is None:
+            return None
+        status, documents, result, error = found
+        documents = json.loads(documents)
+        return {
+            'id': job_id,
+            'status': status,
+            'total': len(documents),
+            'done': sum(document['status'] != 'pending' for document in documents),
+            'documents': documents,
+            'result': json.loads(result) if result is not None else None,
+            'error': error,
+        }
+
+    def delete(self, job_id: str):
+        with connect(self.path) as conn:
+            conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+
+
+class JobQueue:
+    def __init__(self, store: JobStore = None, workers: int = JOB_WORKERS):
+        self.store = JobStore() if store is None else store
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='parse-job')
+
+    def submit(self, filenames: list[str], work: Callable[[Callable[[str, str | None], None]], Any]) -> str:
+        """Start ``work(progress)`` in the background and return the job id.
+
+        ``work`` reports each finished document through ``progress`` and
+        returns a JSON-serializable result.
+        """
+        job_id = self.store.create(filenames)
+        self.executor.submit(self._run, job_id, work)
+        return job_id
+
+    def _run(self, job_id: str, work: Callable):
+        try:
+            result = work(lambda filename, error: self.store.progress(job_id, filename, error))
+        except Exception as e:
+            self.store.fail(job_id, f'{type(e).__name__}: {e}')
+        else:
+            self.store.finish(job_id, result)
@@ -0,0 +1,104 @@
+"""One record type for a lab value from normalization to the final table.
+
+``normalize_rows`` turns the parsed rows of a report into ``LabResult``
+records; the same records are rendered into the verification form, read back
+from it by ``/final``, flagged, stored by ``ResultStore`` and shown in the
+final table. A ``LabResult`` has ``__slots__`` and no per-row dict, and the
+stages update records in place rather than building new ones.
+
+``ResultSet`` is a list of records with the serializations the pipeline
+needs:
+
+* ``from_form`` reads the columns of the verification form (``test-name[]``
+  and friends), one list per field, without building a dict per row;
+* ``to_json``/``from_json`` use the keys the final table, the chart and
+  summary endpoints have always used;
+* ``to_rows``/``from_rows`` are compact lists of values in ``FIELDS`` order,
+  used for the parse cache and background job results.
+"""
+from dataclasses import dataclass, fields
+from typing import Any
+
+from werkzeug.datastructures import MultiDict
+
+
+@dataclass(slots=True)
+class LabResult:
+    test: str = ''
+    value: str = ''
+    units: str = ''
+    low: str = ''
+    high: str = ''
+    flag: str = ''
+    date: str = ''
+    # the test name printed on the report, before standardization
+    original: str = ''
+    qualitative: str = ''
+    # the report (SHA-256 of the PDF) and patient the value was verified from
+    report: str = ''
+    patient: str = ''
+
+    def to_json(self) -> dict[str, str]:
+        return {key: getattr(self, name) for name, key in JSON_KEYS.items()}
+
+
+FIELDS = tuple(field.name for field in fields(LabResult))
+
+JSON_KEYS = {
+    'date': 'Date',
+    'test': 'TestName',
+    'value': 'ObservedValue',
+    'units': 'Units',
+    'low': 'Low',
+    'high': 'High',
+    'flag': 'Flag',
+}
+
+FORM_KEYS = {
+    'date': 'date[]',
+    'test': 'test-name[]',
+    'value': 'correct-value[]',
+    'units': 'correct-units[]',
+    'low': 'correct-low[]',
+    'high': 'correct-high[]',
+    'flag': 'Flag[]',
+    'report': 'report[]',
+}
+
+
+def as_text(value: Any) -> str:
+    return '' if value is None else str(value)
+
+
+class ResultSet(list[LabResult]):
+    @classmethod
+    def from_form(cls, form: MultiDict) -> 'ResultSet':
+        """Rows of the verification form; fields the form does not have are left empty.
+
+        Rows past the end of the shortest column are dropped.
+        """
+        columns = {name: form.getlist(key) for name, key in FORM_KEYS.items() if key in form}
+        results = cls()
+        for values in zip(*columns.values()):
+            result = LabResult()
+            for name, value in zip(columns, values):
+                setattr(result, name, value.strip())
+            results.append(result)
+        return results
+
+    @classmethod
+    def from_json(cls, rows: list[dict[str, Any]]) -> 'ResultSet':
+        return cls(
+            LabResult(**{name: as_text(row.get(key)) for name, key in JSON_KEYS.items()})
+            for row in rows
+        )
+
+    def to_json(self) -> list[dict[str, str]]:
+        return [result.to_json() for result in self]
+
+    @classmethod
+    def from_rows(cls, rows: list[list[str]]) -> 'ResultSet':
+        return cls(LabResult(*row) for row in rows)
+
+    def to_rows(self) -> list[list[str]]:
+        return [[getattr(result, name) for name in FIELDS] for result in self]
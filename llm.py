@@ -0,0 +1,263 @@
+"""LLM access for the lab summary.
+
+Model calls are slow and paid, so they go through a small amount of
+plumbing shared by every route that talks to the model:
+
+* ``make_client`` builds the Gemini client, or ``FakeClient`` when
+  ``LLM_CLIENT=fake`` so the app can be exercised offline.
+* ``LLM_SLOTS`` caps how many model calls run at once across *all* gunicorn
+  workers (``LLM_MAX_CONCURRENCY``). A request that cannot get a slot within
+  ``LLM_QUEUE_TIMEOUT`` seconds is turned away instead of tying up a worker.
+* ``LLM_TIMEOUT`` bounds each model call, including a whole streamed reply.
+
+``build_compact_prompt`` is the shorter prompt used for batch summaries: it
+sends the flagged results and the derived metrics only, and says how many
+results were in range instead of listing them.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import random
+import time
+from contextlib import contextmanager
+from functools import cache
+
+from flags import FLAG_PRIORITY, NOT_ESTABLISHED
+from labresult import LabResult
+from metrics import count, stage
+
+GEMINI_MODEL = os.environ.get('GEMINI_MODEL', 'gemini-2.0-flash-001')
+LLM_CLIENT = os.environ.get('LLM_CLIENT', 'gemini')
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', 4))
+LLM_QUEUE_TIMEOUT = float(os.environ.get('LLM_QUEUE_TIMEOUT', 5))
+LLM_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', 60))
+LLM_LOCK_DIR = os.environ.get('LLM_LOCK_DIR', 'cache/llm-slots')
+
+
+class LLMBusyError(Exception):
+    pass
+
+
+class LLMTimeoutError(Exception):
+    pass
+
+
+# HTTP statuses of model errors that are worth retrying
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+def is_transient(error: Exception) -> bool:
+    """Whether a failed model call may succeed if it is made again later."""
+    if isinstance(error, (LLMBusyError, LLMTimeoutError, TimeoutError, ConnectionError)):
+        return True
+    # errors of the Gemini SDK carry the HTTP status as ``code``
+    return getattr(error, 'code', None) in RETRY_STATUS
+
+
+# Bump whenever the wording of build_prompt (or build_compact_prompt) changes
+# so cached summaries of the old prompt are not reused.
+PROMPT_VERSION = '1'
+COMPACT_PROMPT_VERSION = '1'
+PROMPT_FIELDS = ('test', 'value', 'units', 'low', 'high', 'flag')
+
+
+def flagged_rows(rows: list[LabResult]) -> list[LabResult]:
+    return [r for r in rows if r.flag in FLAG_PRIORITY]
+
+
+def summary_key(rows: list[LabResult], metrics: dict[str, float | None], compact: bool = False) -> str:
+    """Fingerprint everything that determines a summary: the prompt inputs, template and model."""
+    canonical = {
+        'rows': [[getattr(r, k).strip() for k in PROMPT_FIELDS] for r in (flagged_rows(rows) if compact else rows)],
+        'metrics': {k: v for k, v in metrics.items() if v is not None},
+        'prompt': PROMPT_VERSION,
+        'model': GEMINI_MODEL,
+    }
+    if compact:
+        canonical.update(prompt=f'compact-{COMPACT_PROMPT_VERSION}', in_range=len(rows) - len(canonical['rows']))
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True).encode()).hexdigest()
+
+
+def build_prompt(rows: list[LabResult], metrics: dict[str, float | None]) -> str:
+    lab_lines = [
+        f"{r.test}: {r.value} {r.units} (Low: {r.low}, High: {r.high}, Flag: {r.flag})"
+        for r in rows
+    ]
+    metric_lines = [f"{k}: {v}" for k, v in metrics.items() if v is not None]
+
+    return (
+        "Please review included lab markers and calculated values with regard to the condition of insulin resistance. "
+        "Please highlight the risk of insulin resistance based on these values, and also note any other lab findings "
+        "that may be indicative of disease or require follow-up labs and physician discussion.\n\n"
+        "Please provide a concise summary in 2-3 paragraphs.\n\n" +
+        "Insulin Metrics:\n" + "\n".join(metric_lines) + "\n\nLab Values:\n" + "\n".join(lab_lines)
+    )
+
+
+def _reference(r: LabResult) -> str:
+    if not r.low or r.low in NOT_ESTABLISHED or not r.high or r.high in NOT_ESTABLISHED:
+        return ''
+    return f" (ref {r.low}-{r.high})"
+
+
+def build_compact_prompt(rows: list[LabResult], metrics: dict[str, float | None]) -> str:
+    flagged = flagged_rows(rows)
+    lab_lines = [f"{r.test}: {r.value} {r.units} {r.flag}{_reference(r)}" for r in flagged]
+    metric_lines = [f"{k}: {v}" for k, v in metrics.items() if v is not None]
+    in_range = len(rows) - len(flagged)
+
+    return (
+        "Review these lab results with regard to insulin resistance: highlight the risk of insulin resistance "
+        "and any findings that need follow-up labs or physician discussion. Reply in 2-3 short paragraphs.\n\n"
+        "Insulin Metrics:\n" + ("\n".join(metric_lines) or "none") +
+        "\n\nOut of Range:\n" + ("\n".join(lab_lines) or "none") +
+        f"\n\n{in_range} other results were within their reference ranges."
+    )
+
+
+class _FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeServerError(Exception):
+    code = 503
+
+
+class _FakeModels:
+    def __init__(self, text: str, delay: float, failure_rate: float):
+        self.text = text
+        self.delay = delay
+        self.failure_rate = failure_rate
+
+    def generate_content(self, model: str, contents: list[str], config=None) -> _FakeResponse:
+        time.sleep(self.delay * len(self.text.split()))
+        if random.random() < self.failure_rate:
+            raise FakeServerError('503 UNAVAILABLE: the fake model is overloaded')
+        return _FakeResponse(self.text)
+
+    def generate_content_stream(self, model: str, contents: list[str], config=None):
+        for word in self.text.split(' '):
+            time.sleep(self.delay)
+            yield _FakeResponse(word + ' ')
+
+
+class FakeClient:
+    """Stands in for ``genai.Client``, replying with canned text word by word.
+
+    ``failure_rate`` of the non-streamed calls fail like an overloaded model,
+    to exercise retries.
+    """
+
+    TEXT = (
+        'This is a locally generated summary used for offline testing. '
+        'No lab values were sent to a language model.'
+    )
+
+    def __init__(
+        self, text: str = TEXT,
+        delay: float = float(os.environ.get('FAKE_LLM_DELAY', 0.05)),
+        failure_rate: float = float(os.environ.get('FAKE_LLM_FAILURE_RATE', 0)),
+    ):
+        self.models = _FakeModels(text, delay, failure_rate)
+
+
+def make_client():
+    if LLM_CLIENT == 'fake':
+        return FakeClient()
+
+    from google import genai
+    from google.genai import types
+    return genai.Client(
+        api_key=os.environ.get('GEMINI_API_KEY'),
+        http_options=types.HttpOptions(timeout=int(LLM_TIMEOUT * 1000)),
+    )
+
+
+@cache
+def shared_client():
+    """The client the app uses, made on first use so workers start without importing the SDK."""
+    return make_client()
+
+
+class SlotLimiter:
+    """A cross-process semaphore made of ``flock``-ed slot files.
+
+    Locks are released by the kernel if a worker dies, so a crashed request
+    never leaks a slot.
+    """
+
+    def __init__(self, directory: str, slots: int):
+        self.directory = directory
+        self.slots = slots
+        os.makedirs(directory, exist_ok=True)
+
+    def _try_acquire(self) -> int | None:
+        for slot in range(self.slots):
+            fd = os.open(os.path.join(self.directory, f'{slot}.lock'), os.O_CREAT | os.O_RDWR)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            return fd
+        return None
+
+    @contextmanager
+    def acquire(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        while (fd := self._try_acquire()) is None:
+            if time.monotonic() >= deadline:
+                raise LLMBusyError('Too many summaries are being generated, please try again shortly.')
+            time.sleep(0.05)
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+
+LLM_SLOTS = SlotLimiter(LLM_LOCK_DIR, LLM_MAX_CONCURRENCY)
+
+
+@contextmanager
+def _recorded():
+    """Time a model call and count it by how it ended."""
+    status = 'error'
+    try:
+        with stage('llm'):
+            yield
+        status = 'ok'
+    except LLMBusyError:
+        status = 'busy'
+        raise
+    except LLMTimeoutError:
+        status = 'timeout'
+        raise
+    except GeneratorExit:
+        # the client went away while the reply was streaming
+        status = 'cancelled'
+        raise
+    finally:
+        count('llm_calls_total', status=status)
+
+
+def generate(client, prompt: str) -> str:
+    with _recorded(), LLM_SLOTS.acquire(LLM_QUEUE_TIMEOUT):
+        return client.models.generate_content(model=GEMINI_MODEL, contents=[prompt]).text
+
+
+def generate_stream(client, prompt: str):
+    """Yield pieces of the reply as the model produces them.
+
+    The slot is held until the stream finishes; once ``LLM_TIMEOUT`` has
+    passed the stream is abandoned with ``LLMTimeoutError``.
+    """
+    with _recorded(), LLM_SLOTS.acquire(LLM_QUEUE_TIMEOUT):
+        deadline = time.monotonic() + LLM_TIMEOUT
+        for chunk in client.models.generate_content_stream(model=GEMINI_MODEL, contents=[prompt]):
+            if chunk.text:
+                yield chunk.text
+            if time.monotonic() > deadline:
+                raise LLMTimeoutError(f'Summary took longer than {LLM_TIMEOUT:g}s')
@@ -0,0 +1,220 @@
+"""Timing and counters for the hot paths, exported in Prometheus text format.
+
+``stage(name)`` times a block of code into the ``labpdf_stage_seconds``
+histogram; ``count(name, **labels)`` bumps a counter. Both only take a lock
+and update a few numbers, so they stay on in production.
+
+Stages timed while a ``collect()`` block is active on the same thread are
+also added up in the dict it yields. The app uses that for the per-request
+``Server-Timing`` header, and the parse engine uses it to carry timings back
+from its worker processes, which have registries of their own, so they can be
+merged into the registry of the process that asked for the parse.
+
+Every gunicorn worker keeps its own registry and writes it to
+``METRICS_DIR`` at most every ``METRICS_FLUSH_INTERVAL`` seconds; ``/metrics``
+adds up the files of all live workers.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+METRICS_DIR = os.environ.get('METRICS_DIR', 'cache/metrics')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 1))
+
+PREFIX = 'labpdf'
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+HELP = {
+    'stage_seconds': 'Time spent in each stage of handling a request.',
+    'request_seconds': 'Time to produce a response, by endpoint.',
+    'requests_total': 'Responses sent, by endpoint and status.',
+    'documents_total': 'Documents parsed, by outcome.',
+    'pages_total': 'Pages in parsed documents.',
+    'pages_skipped_total': 'Pages the parser skipped without extracting their text.',
+    'rows_total': 'Result rows parsed from documents.',
+    'cache_requests_total': 'Cache lookups, by cache and result.',
+    'llm_calls_total': 'Model calls, by outcome.',
+    'batch_summaries_total': 'Batch summaries, by outcome.',
+}
+
+
+def _key(labels: dict[str, str]) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)
+        # name, labels -> [bucket counts..., +Inf count, sum]
+        self.histograms = {}
+
+    def count(self, name: str, amount: float = 1, **labels):
+        with self.lock:
+            self.counters[name, _key(labels)] += amount
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, _key(labels))
+        with self.lock:
+            if (histogram := self.histograms.get(key)) is None:
+                histogram = self.histograms[key] = [0] * (len(BUCKETS) + 2)
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += value
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                'counters': [[name, labels, value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, labels, list(values)] for (name, labels), values in self.histograms.items()],
+            }
+
+
+REGISTRY = Registry()
+_local = threading.local()
+
+
+def _after_fork():
+    # another request thread may have held the lock when the parse pool forked
+    REGISTRY.lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def count(name: str, amount: float = 1, **labels):
+    REGISTRY.count(name, amount, **labels)
+
+
+def observe_stage(name: str, seconds: float):
+    REGISTRY.observe('stage_seconds', seconds, stage=name)
+    for timings in getattr(_local, 'collectors', ()):
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def stage(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - start)
+
+
+@contextmanager
+def collect():
+    """Also add up, by stage, the time of every stage this thread runs inside the block."""
+    timings = {}
+    collectors = _local.__dict__.setdefault('collectors', [])
+    collectors.append(timings)
+    try:
+        yield timings
+    finally:
+        collectors.remove(timings)
+
+
+def merge_stages(timings: dict[str, float]):
+    """Record stage timings measured in another process."""
+    for name, seconds in timings.items():
+        observe_stage(name, seconds)
+
+
+_last_flush = 0.0
+
+
+def flush(force: bool = False):
+    """Write this process's metrics where ``/metrics`` in any worker can read them."""
+    global _last_flush
+    if not force and time.monotonic() - _last_flush < METRICS_FLUSH_INTERVAL:
+        return
+    _last_flush = time.monotonic()
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    with tempfile.NamedTemporaryFile('w', dir=METRICS_DIR, suffix='.tmp', delete=False) as f:
+        json.dump(REGISTRY.snapshot(), f)
+    os.replace(f.name, os.path.join(METRICS_DIR, f'{os.getpid()}.json'))
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _merged() -> Registry:
+    flush(force=True)
+    merged = Registry()
+    for entry in os.scandir(METRICS_DIR):
+        name, ext = os.path.splitext(entry.name)
+        if ext != '.json' or not name.isdigit():
+            continue
+        if not _alive(int(name)):
+            # a worker that exited; its numbers go with it
+            os.unlink(entry.path)
+            continue
+        try:
+            with open(entry.path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for metric, labels, value in snapshot['counters']:
+            merged.counters[metric, tuple(map(tuple, labels))] += value
+        for metric, labels, values in snapshot['histograms']:
+            key = (metric, tuple(map(tuple, labels)))
+            if key in merged.histograms:
+                merged.histograms[key] = [a + b for a, b in zip(merged.histograms[key], values)]
+            else:
+                merged.histograms[key] = values
+    return merged
+
+
+def _labels(labels: tuple, **extra) -> str:
+    pairs = [*labels, *extra.items()]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+
+def render() -> str:
+    """All workers' metrics in the Prometheus text exposition format."""
+    registry = _merged()
+    lines = []
+    by_name = defaultdict(list)
+    for (name, labels), value in sorted(registry.counters.items()):
+        by_name[name].append((labels, value))
+    for name, samples in by_name.items():
+        lines += [f'# HELP {PREFIX}_{name} {HELP.get(name, name)}', f'# TYPE {PREFIX}_{name} counter']
+        lines += [f'{PREFIX}_{name}{_labels(labels)} {value:g}' for labels, value in samples]
+
+    by_name = defaultdict(list)
+    for (name, labels), values in sorted(registry.histograms.items()):
+        by_name[name].append((labels, values))
+    for name, samples in by_name.items():
+        lines += [f'# HELP {PREFIX}_{name} {HELP.get(name, name)}', f'# TYPE {PREFIX}_{name} histogram']
+        for labels, values in samples:
+            for bound, cumulative in zip(BUCKETS, values):
+                lines.append(f'{PREFIX}_{name}_bucket{_labels(labels, le=f"{bound:g}")} {cumulative}')
+            lines.append(f'{PREFIX}_{name}_bucket{_labels(labels, le="+Inf")} {values[-2]}')
+            lines.append(f'{PREFIX}_{name}_sum{_labels(labels)} {values[-1]:g}')
+            lines.append(f'{PREFIX}_{name}_count{_labels(labels)} {values[-2]}')
+
+    # hit rates are easy to get wrong in PromQL, so they are exported ready-made
+    lookups = defaultdict(lambda: [0.0, 0.0])
+    for (name, labels), value in registry.counters.items():
+        if name == 'cache_requests_total':
+            labels = dict(labels)
+            lookups[labels['cache']][labels['result'] == 'hit'] += value
+    if lookups:
+        lines += [f'# HELP {PREFIX}_cache_hit_ratio Share of cache lookups that were hits.', f'# TYPE {PREFIX}_cache_hit_ratio gauge']
+        for cache, (misses, hits) in sorted(lookups.items()):
+            lines.append(f'{PREFIX}_cache_hit_ratio{{cache="{cache}"}} {hits / (hits + misses):g}')
+    return '\n'.join(lines) + '\n'
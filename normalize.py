@@ -0,0 +1,92 @@
+"""Normalization of parsed rows against the reference catalog.
+
+Matches the test names printed on a report to entries of
+``default_ranges.json`` (through ``common_aliases.json`` and fuzzy matching)
+and fills in units and reference ranges. Shared by the web app and the batch
+ingestion command so both produce the same rows.
+"""
+import hashlib
+import re
+
+from catalog import CATALOG
+from labresult import LabResult, ResultSet, as_text
+
+DEFAULT_RANGES = CATALOG.ranges
+COMMON_TEST_ALIASES = CATALOG.aliases
+
+# Tests that should always use hard-coded reference ranges even if the
+# PDF supplies its own "Reference Interval" value.
+FORCE_DEFAULT_RANGES = {
+    "Neutrophils %",
+    "Lymphocytes %",
+    "Monocytes %",
+    "Eosinophils %",
+    "Basophils %",
+}
+
+# Bump whenever the fields of LabResult change.
+RESULT_FORMAT = '2'
+
+# Identifies the reference data normalized rows were built against, and how
+# they are stored, so cached rows are rebuilt whenever either changes.
+CATALOG_VERSION = hashlib.sha256(
+    '|'.join([RESULT_FORMAT, CATALOG.digests['ranges'], CATALOG.digests['aliases'], *sorted(FORCE_DEFAULT_RANGES)]).encode()
+).hexdigest()[:16]
+
+RESOLVER = CATALOG.resolver
+
+# Add this list of excluded test names (case-insensitive)
+EXCLUDED_TEST_NAMES = {"pdf", "disclaimer"}
+
+
+def normalize_rows(data) -> ResultSet:
+    """Match parsed PDF rows to standardized test names and reference ranges."""
+    rows = ResultSet()
+    for row in data:
+        # Skip unwanted test names
+        if row["Test"].casefold() in EXCLUDED_TEST_NAMES:
+            continue
+
+        low, high, qualitative, units = None, None, None, row.get('Units')
+        test_name = RESOLVER.standardize(row["Test"], row["Units"], row["Panel"])
+        if test_name in DEFAULT_RANGES:
+            match DEFAULT_RANGES[test_name]:
+                case [qualitative, units]:
+                    pass
+                case [low, high, units]:
+                    pass
+                case [low, high, units, _, _, _]:
+                    pass
+
+        value = row["Current Result"]
+        # --- Force default value for C-Reactive Protein, Quant if missing ---
+        if test_name.lower() in ["c-reactive protein, quant", "c-reactive protein, qu", "c-reactive protein"]:
+            if not value or value.strip() == "":
+                value = "<1"
+
+        if row["Reference Interval"] is not None and test_name not in FORCE_DEFAULT_RANGES:
+            if row["Reference Interval"].startswith("<"):
+                high = row["Reference Interval"].removeprefix("<")
+                low = "0"
+            elif row["Reference Interval"].startswith(">"):
+                low = row["Reference Interval"].removeprefix(">")
+                high = None
+            else:
+                parts = re.split(r"\s*[-\u2013]\s*", row["Reference Interval"])
+                if row['Reference Interval'].startswith(('-', '\u2013')) and len(parts) == 3:
+                    low, high = f'-{parts[0]}{parts[1]}', parts[2]
+                else:
+                    low, high = parts[0], parts[1] if len(parts) > 1 else None
+
+        # catalog ranges may be numbers; every field of a result is text
+        rows.append(LabResult(
+            test=as_text(test_name),
+            value=as_text(value),
+            units=as_text(units),
+            low=as_text(low),
+            high=as_text(high),
+            flag=as_text(row["Flag"]),
+            original=as_text(row["Test"]),
+            qualitative=as_text(qualitative),
+        ))
+    return rows
@@ -1,20 +1,124 @@
+from bisect import bisect_left, bisect_right
 from collections import defaultdict
+from functools import cached_property
 from pathlib import Path
 
 from itertools import islice, tee
 import fitz
 from fitz import Document, Page, Rect
 
+from metrics import stage
+
 from typing import Generator, Any, DefaultDict
 import re
 
+# Bump whenever the output of parse_labcorp_pdf changes; cached parse
+# results from other versions are ignored.
+PARSER_VERSION = '4'
+
+# the column headers of a LabCorp results table, left to right
+LABCORP_HEADERS = ['Test', 'Current Result and Flag', 'Previous Result and Date', 'Units', 'Reference Interval']
+
+
+def _union(bboxes) -> tuple[float, float, float, float]:
+    x0s, y0s, x1s, y1s = zip(*bboxes)
+    return min(x0s), min(y0s), max(x1s), max(y1s)
+
+
+class ParsedPage:
+    """A page whose text has been run through MuPDF exactly once.
+
+    A single ``TextPage`` is built up front and the words, blocks and span
+    dictionaries needed by the helpers below are all derived from it.
+    """
+
+    def __init__(self, page: Page):
+        self.page = page
+        self.number = page.number
+        self.rect = page.rect
+        with stage('extract'):
+            self.textpage = page.get_textpage(flags=fitz.TEXTFLAGS_DICT)
+
+    @cached_property
+    def text(self) -> str:
+        """Plain text of the page, cheap enough to decide whether the page is worth parsing."""
+        with stage('extract'):
+            return self.page.get_text("text", textpage=self.textpage)
+
+    @cached_property
+    def words(self) -> list[tuple]:
+        """Equivalent of ``page.get_text("words", sort=True)``."""
+        with stage('extract'):
+            return self.page.get_text("words", textpage=self.textpage, sort=True)
+
+    @cached_property
+    def blocks(self) -> list[tuple]:
+        """Equivalent of ``page.get_text("blocks")`` (text blocks only)."""
+        with stage('extract'):
+            blocks = self.page.get_text("blocks", textpage=self.textpage)
+        return [block for block in blocks if block[6] == 0]
+
+    @cached_property
+    def _dict_blocks(self) -> list[dict[str, Any]]:
+        with stage('extract'):
+            return self.page.get_text("dict", textpage=self.textpage)["blocks"]
+
+    def text_blocks(self, clip: Rect = None) -> list[dict[str, Any]]:
+        """Equivalent of ``page.get_text("dict", sort=True, clip=clip)["blocks"]``.
+
+        A clipped extraction gets its own ``TextPage`` built with the clip,
+        so which characters and lines are kept is decided by MuPDF itself.
+        """
+        if clip is None:
+            blocks = self._dict_blocks
+        else:
+            with stage('extract'):
+                textpage = self.page.get_textpage(clip=clip, flags=fitz.TEXTFLAGS_DICT)
+                blocks = self.page.get_text("dict", textpage=textpage)["blocks"]
+        return sorted(blocks, key=lambda b: (b["bbox"][3], b["bbox"][0]))
+
+
+class ParsedDocument:
+    """Lazily wraps each page of a document in a :class:`ParsedPage`.
+
+    ``skipped_pages`` counts the pages ``extract_tables`` did not need to
+    extract tables from, and ``table_regions`` holds the bounding box of the
+    table cells it found on each page, by page number.
+    """
+
+    def __init__(self, doc: Document):
+        self.doc = doc
+        self._pages: dict[int, ParsedPage] = {}
+        self.skipped_pages = 0
+        self.table_regions: dict[int, tuple[float, float, float, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self.doc)
+
+    def __getitem__(self, number: int) -> ParsedPage:
+        if number not in self._pages:
+            self._pages[number] = ParsedPage(self.doc[number])
+        return self._pages[number]
+
+    def __iter__(self):
+        for number in range(len(self)):
+            yield self[number]
+
 
-def find_table_headers(page: Page, headers: list[str]) -> dict[str, Rect]:
+def as_parsed(page: Page | ParsedPage) -> ParsedPage:
+    return page if isinstance(page, ParsedPage) else ParsedPage(page)
+
+
+def as_parsed_document(doc: Document | ParsedDocument) -> ParsedDocument:
+    return doc if isinstance(doc, ParsedDocument) else ParsedDocument(doc)
+
+
+def find_table_headers(page: Page | ParsedPage, headers: list[str]) -> dict[str, Rect]:
     """Finds the bounding box for all table headers (e.g. "Test", "Current Results and Flag", etc.)
 
     Returns a dictionary mapping those headers to their Rectangle bounding box.
     """
-    for block in page.get_text("dict", sort=True)["blocks"]:
+    for block in as_parsed(page).text_blocks():
         if 'lines' not in block:
             continue
 
@@ -27,12 +131,50 @@ def find_table_headers(page: Page, headers: list[str]) -> dict[str, Rect]:
     raise ValueError(msg)
 
 
-def find_ordered_items(page: Page) -> list[str]:
+class ColumnLayout:
+    """Table columns as x-intervals, built once per document from the header rects.
+
+    ``assign`` picks, for each text bbox, the column whose full-height strip
+    overlaps it by the largest area, with ties going to the earlier header;
+    this is the same answer as intersecting a page-height ``Rect`` per column,
+    without creating any. When the columns do not overlap each other only the
+    ones between two bisections of their edges are looked at.
+    """
+
+    def __init__(self, header_rects: dict[str, Rect]):
+        self.names = list(header_rects)
+        order = sorted(range(len(self.names)), key=lambda i: header_rects[self.names[i]].x0)
+        self.order = order
+        self.x0s = [header_rects[self.names[i]].x0 for i in order]
+        self.x1s = [header_rects[self.names[i]].x1 for i in order]
+        self.disjoint = all(x1 <= x0 for x1, x0 in zip(self.x1s, self.x0s[1:])) and self.x1s == sorted(self.x1s)
+
+    def assign(self, bboxes: list[tuple[float, float, float, float]], height: float) -> list[str]:
+        names, order, x0s, x1s = self.names, self.order, self.x0s, self.x1s
+        everything = range(len(order))
+        assigned = []
+        for tx0, ty0, tx1, ty1 in bboxes:
+            best, best_area = 0, 0.0
+            h = min(ty1, height) - max(ty0, 0)
+            if h > 0:
+                candidates = range(bisect_right(x1s, tx0), bisect_left(x0s, tx1)) if self.disjoint else everything
+                for j in candidates:
+                    w = min(tx1, x1s[j]) - max(tx0, x0s[j])
+                    if w <= 0:
+                        continue
+                    area, i = w * h, order[j]
+                    if area > best_area or (area == best_area and i < best):
+                        best, best_area = i, area
+            assigned.append(names[best])
+        return assigned
+
+
+def find_ordered_items(page: Page | ParsedPage) -> list[str]:
     """Finds all of the tests listed after "Ordered Items:"
 
     These are use for subsequent section identification.
     """
-    for x0, y0, x1, y1, text, _, _ in page.get_text("blocks"):
+    for x0, y0, x1, y1, text, _, _ in as_parsed(page).blocks:
         if text.strip().startswith('Ordered Items'):
             section_headers = [
                 t.strip().replace('\n', ' ') for t in
@@ -43,12 +185,15 @@ def find_ordered_items(page: Page) -> list[str]:
     raise ValueError(msg)
 
 
-def iter_section_blocks(page: Page, section_headers: list[str], stop_text: str, clip: Rect = None) -> Generator[tuple[str, dict[str, Any]], None, None]:
+def iter_section_blocks(page: Page | ParsedPage, section_headers: list[str], stop_text: str, clip: Rect = None) -> Generator[tuple[str, dict[str, Any]], None, bool]:
     """Traverse a page, producing each block and the section that was last observed.
+
+    Yielded blocks are copies; the cached extraction of the page is left intact.
+    Returns whether ``stop_text`` was reached.
     """
     key = None
     stop = False
-    for block in page.get_text('dict', sort=True, clip=clip)['blocks']:
+    for block in as_parsed(page).text_blocks(clip=clip):
         lines = []
         for line in block.get('lines', []):
             spans = []
@@ -62,71 +207,100 @@ def iter_section_blocks(page: Page, section_headers: list[str], stop_text: str,
                     break
                 spans.append(span)
             if spans:
-                line['spans'] = spans
+                line = {**line, 'spans': spans}
             if stop:
                 break
             lines.append(line)
         if lines:
-            block['lines'] = lines
+            block = {**block, 'lines': lines}
 
         if key is not None:
             yield key, block
         if stop:
-            return
+            return True
+    return False
 
 
-def extract_tables(doc: Page) -> DefaultDict[str, list[str]]:
+def extract_tables(doc: Document | ParsedDocument) -> DefaultDict[str, list[str]]:
+    doc = as_parsed_document(doc)
+
     # extract expected section headers based on page 0 "Ordered Items:"
     section_headers, section_header_rect = find_ordered_items(doc[0])
 
     # extract table header locations to guide subsequent table parsing
-    headers = ['Test', 'Current Result and Flag', 'Previous Result and Date', 'Units', 'Reference Interval']
-    header_rects = find_table_headers(doc[0], headers=headers)
+    header_rects = find_table_headers(doc[0], headers=LABCORP_HEADERS)
+
+    columns = ColumnLayout(header_rects)
+
+    # a page can only hold table rows below a section heading, and parsing
+    #   ends at the first page with the stop text; any other page is skipped
+    #   on its plain text before the far costlier span extraction
+    stop_text = 'Disclaimer'
+    markers = [*section_headers, stop_text]
 
     table_data = defaultdict(list)
+    doc.skipped_pages = 0
+    doc.table_regions = {}
     for page in doc:
+        if not any(marker in page.text for marker in markers):
+            doc.skipped_pages += 1
+            continue
+
         clip = None
         if page.number == 0:
             clip = Rect(*section_header_rect)
             clip.y0 = clip.y1
             clip.y1 = page.rect.height
-        for section, block in iter_section_blocks(page, section_headers, stop_text='Disclaimer', clip=clip):
-            row = {text: [] for text in header_rects}
+
+        # gather the lines of every block on the page that can hold a cell,
+        #   then find all of their columns in one pass
+        blocks = []
+        sections = iter_section_blocks(page, section_headers, stop_text=stop_text, clip=clip)
+        while True:
+            try:
+                section, block = next(sections)
+            except StopIteration as done:
+                stopped = done.value
+                break
             if 'lines' not in block:
                 continue
+            lines = [
+                line for line in block['lines']
+                if (text := line['spans'][0]['text']).strip() and not text.startswith(' ')
+                and line['spans'][0]['size'] == 9
+            ]
+            blocks.append((section, lines))
+        bboxes = [line['bbox'] for _, lines in blocks for line in lines]
+        if bboxes:
+            doc.table_regions[page.number] = _union(bboxes)
+        assigned = iter(columns.assign(bboxes, page.rect.height))
 
-            # iterates left to right within the current block
-            #   align current text against extracted header info
-            for line in block['lines']:
-                text, font_size, text_bbox = line['spans'][0]['text'], line['spans'][0]['size'], line['bbox']
-                if not text.strip() or text.startswith(' ') or font_size != 9:
-                    continue
+        for section, lines in blocks:
+            row = {text: [] for text in header_rects}
 
-                # find the most appropriate column based on maximum area overlap
-                # carve the current "column" from the table and measure its
-                #   intersection against the current text
-                text_bbox = Rect(*text_bbox)
-                closest_header = max(
-                    header_rects,
-                    key=lambda k:
-                        Rect(x0=header_rects[k].x0, y0=0, x1=header_rects[k].x1, y1=page.rect.height)
-                        .intersect(text_bbox).get_area()
-                )
+            # iterates left to right within the current block
+            #   the column is the one whose strip overlaps the text the most
+            for line in lines:
+                closest_header = next(assigned)
                 if closest_header != 'Reference Interval' and row['Reference Interval'] != []:
                     continue
-                row[closest_header].append(text)
+                row[closest_header].append(line['spans'][0]['text'])
             if any(row.values()):
                 table_data[section].append(row)
 
+        if stopped:
+            doc.skipped_pages += len(doc) - page.number - 1
+            break
+
     return table_data
 
 def nwise(iterable, *, n=2):
     return zip(*(islice(it, i, None) for i, it in enumerate(tee(iterable, n))))
 
-def extract_keyvalue(page, keys):
+def extract_keyvalue(page: Page | ParsedPage, keys):
     result = {}
     kwords = [k.split() for k in keys]
-    texts = (tup[4] for tup in page.get_text("words", sort=True))
+    texts = (tup[4] for tup in as_parsed(page).words)
     for words in nwise(texts, n=max(len(k) for k in kwords)+1):
         for k in keys:
             if k in result:
@@ -137,15 +311,23 @@ def extract_keyvalue(page, keys):
     return result
 
 
-def parse_labcorp_pdf(doc: Page) -> tuple[dict[str, str], dict[str, str], list[dict[str, str]]]:
+def is_labcorp_report(page: Page | ParsedPage) -> bool:
+    """Whether the first page has the "Ordered Items" box and column headers of a LabCorp report."""
+    text = as_parsed(page).text
+    return 'Ordered Items' in text and all(header in text for header in LABCORP_HEADERS)
+
+
+def parse_labcorp_pdf(doc: Document | ParsedDocument) -> tuple[dict[str, str], dict[str, str], list[dict[str, str]]]:
+    doc = as_parsed_document(doc)
     subject_metadata = {
         **extract_keyvalue(doc[0], keys=['DOB', 'Age', 'Sex']),
-        'Name': doc[0].get_text("blocks")[0][4].split('\n', maxsplit=1)
+        'Name': doc[0].blocks[0][4].split('\n', maxsplit=1)
     }
 
     keys = ['Date Collected', 'Date Received', 'Date Reported', 'Fasting']
     sample_metadata = extract_keyvalue(doc[0], keys=keys)
-    parsed_tables = extract_tables(doc)
+    with stage('tables'):
+        parsed_tables = extract_tables(doc)
     skip_tests = [v.casefold() for v in ['Note', 'Urinalysis Gross Exam']]
 
     clean_pdf_rows = []
@@ -185,9 +367,12 @@ def parse_labcorp_pdf(doc: Page) -> tuple[dict[str, str], dict[str, str], list[d
                 row['Current Result'] = re.sub(r'^<\s*([0-9.]+)$', r'<\1', row['Current Result'])
                 row['Current Result'] = re.sub(r'^>\s*([0-9.]+)$', r'>\1', row['Current Result'])
 
-            clean_pdf_rows.append(
-                {k: v if isinstance(v, str) else ' '.join(v) for k, v in row.items()} | {'Panel': name}
-            )
+            # the row becomes the output row rather than being copied into one
+            for k, v in row.items():
+                if not isinstance(v, str):
+                    row[k] = ' '.join(v)
+            row['Panel'] = name
+            clean_pdf_rows.append(row)
 
     return subject_metadata, sample_metadata, clean_pdf_rows
 
@@ -0,0 +1,42 @@
+"""PNG crops of the result tables of an uploaded report.
+
+The verification page shows these next to the parsed rows instead of
+embedding every whole PDF. A crop covers the table cells ``extract_tables``
+found on one page (``ParseResult.regions``, kept in the parse cache), plus
+``PREVIEW_PADDING`` points, rendered at ``PREVIEW_DPI``. Only that clip of
+the page is rasterized.
+"""
+import os
+
+from fitz import Rect
+
+from engine import Source, open_source
+from formats import parse_report
+from parse import ParsedDocument
+
+PREVIEW_DPI = int(os.environ.get('PREVIEW_DPI', 110))
+PREVIEW_PADDING = 6
+
+# Bump whenever the look of render_preview changes so cached crops are not reused.
+PREVIEW_VERSION = '1'
+
+
+def preview_key(digest: str, page: int) -> str:
+    return f'{digest}-{page}-{PREVIEW_DPI}-{PREVIEW_VERSION}'
+
+
+def find_regions(source: Source) -> list[list[float]]:
+    """Table regions of a report whose parse results are no longer cached."""
+    with open_source(source) as doc:
+        parsed = ParsedDocument(doc)
+        parse_report(parsed)
+        return [[number, *bbox] for number, bbox in sorted(parsed.table_regions.items())]
+
+
+def render_preview(source: Source, region: list[float]) -> bytes:
+    number, *bbox = region
+    with open_source(source) as doc:
+        page = doc[int(number)]
+        clip = Rect(bbox) + (-PREVIEW_PADDING, -PREVIEW_PADDING, PREVIEW_PADDING, PREVIEW_PADDING)
+        clip.intersect(page.rect)
+        return page.get_pixmap(dpi=PREVIEW_DPI, clip=clip).tobytes('png')
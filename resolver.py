@@ -0,0 +1,127 @@
+"""Resolve test names from PDFs to entries of the reference range catalog.
+
+``TestNameResolver`` is built once at startup. Catalog keys are normalized
+up front and indexed by character trigram, so fuzzy lookups only score the
+handful of keys that can possibly match instead of the whole catalog, and
+every answer is memoized.
+"""
+from collections import defaultdict
+from functools import lru_cache
+from json import load
+
+# characters ignored when fuzzy matching test names
+_CLEAN_TABLE = str.maketrans('', '', ' ,()')
+
+# a fuzzy match must share more than this fraction of distinct characters
+FUZZY_THRESHOLD = 0.5
+
+
+def clean_name(name: str) -> str:
+    return name.lower().translate(_CLEAN_TABLE)
+
+
+def trigrams(text: str) -> set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TestNameResolver:
+    def __init__(self, ranges: dict[str, list], aliases: dict[str, str], cache_size: int = 4096):
+        self.ranges = ranges
+        self.aliases = aliases
+
+        self._keys = list(ranges)
+        self._clean_keys = [clean_name(key) for key in self._keys]
+        self._key_charsets = [set(key) for key in self._clean_keys]
+        self._key_trigrams = [trigrams(key) for key in self._clean_keys]
+
+        self._postings = defaultdict(list)
+        self._short_keys = []
+        for index, grams in enumerate(self._key_trigrams):
+            if not grams:
+                self._short_keys.append(index)
+            for gram in grams:
+                self._postings[gram].append(index)
+
+        self.cache_size = cache_size
+        self._memoize()
+
+    def _memoize(self):
+        self.standardize = lru_cache(maxsize=self.cache_size)(self._standardize)
+        self.resolve = lru_cache(maxsize=self.cache_size)(self._resolve)
+
+    def __getstate__(self):
+        # the index is pickled, the memoized answers are not
+        state = self.__dict__.copy()
+        del state['standardize'], state['resolve']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._memoize()
+
+    @classmethod
+    def from_files(cls, ranges_path: str = 'default_ranges.json', aliases_path: str = 'common_aliases.json') -> 'TestNameResolver':
+        with open(ranges_path) as f:
+            ranges = load(f)
+        with open(aliases_path) as f:
+            aliases = load(f)
+        return cls(ranges, aliases)
+
+    def _standardize(self, test: str, units: str, panel: str) -> str:
+        """Pick the standardized name for a row parsed from a PDF.
+
+        Candidates are tried most specific first and passed through the alias
+        table; the first one found in the catalog wins. Otherwise the aliased
+        test name is returned unchanged.
+        """
+        test_name = test
+        for candidate in (f'{test} {units}', f'{panel} - {test}', test):
+            test_name = self.aliases.get(candidate.casefold(), candidate)
+            if test_name in self.ranges:
+                break
+        return test_name
+
+    def _candidates(self, test_clean: str) -> list[int]:
+        """Indices of keys that contain, or are contained in, ``test_clean``."""
+        grams = trigrams(test_clean)
+        if not grams:
+            # too short to index; these are rare and memoized afterwards
+            return [
+                index for index, key in enumerate(self._clean_keys)
+                if test_clean in key or key in test_clean
+            ]
+
+        # a key containing the test must contain all of its trigrams, and a key
+        # contained in the test has all of its trigrams among the test's
+        hits = defaultdict(int)
+        for gram in grams:
+            for index in self._postings.get(gram, ()):
+                hits[index] += 1
+        candidates = [
+            index for index, count in hits.items()
+            if count == len(grams) or count == len(self._key_trigrams[index])
+        ]
+        candidates.extend(index for index in self._short_keys if self._clean_keys[index] in test_clean)
+        return sorted(
+            index for index in set(candidates)
+            if test_clean in self._clean_keys[index] or self._clean_keys[index] in test_clean
+        )
+
+    def _resolve(self, test: str) -> str | None:
+        """Find the catalog key for ``test``, exactly or by fuzzy match."""
+        if test in self.ranges:
+            return test
+
+        test_clean = clean_name(test)
+        if not test_clean:
+            return None
+        test_chars = set(test_clean)
+
+        matched_key, best_match_score = None, 0
+        for index in self._candidates(test_clean):
+            key_chars = self._key_charsets[index]
+            score = len(test_chars & key_chars) / len(test_chars | key_chars)
+            if score > best_match_score:
+                matched_key, best_match_score = self._keys[index], score
+
+        return matched_key if best_match_score > FUZZY_THRESHOLD else None
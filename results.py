@@ -0,0 +1,179 @@
+"""Verified lab results, kept so trends can be read back without the PDFs.
+
+Every row ``/final`` produces is saved under the patient it belongs to and
+the report (the SHA-256 of the uploaded PDF) it came from. Verifying a report
+again replaces its rows. Results are indexed by report, and by patient, test
+and collection date, so a patient's latest values come from a single indexed
+read instead of uploading and re-parsing every report.
+
+Patients are identified by ``patient_key``, a digest of the name and date of
+birth printed on the report. Which patient a report belongs to is recorded
+when it is parsed (``save_upload``) and looked up by ``owners``, never taken
+from the form. Anyone can print a name and date of birth into a PDF, so the
+web app only ever reads results back by report: knowing the SHA-256 of a PDF
+is proof of having it, knowing whose it is proves nothing.
+
+``verified`` tells which uploads were verified before, so an incremental
+upload only has to parse and verify the new reports; ``history`` then reads
+the results of those and the skipped reports back already in the order
+``/final`` shows them.
+"""
+import hashlib
+import os
+import time
+from datetime import datetime
+from typing import Any
+
+from cache import connect, prepare
+from labresult import LabResult, ResultSet
+
+RESULTS_DB_PATH = os.environ.get('RESULTS_DB_PATH', 'cache/results.sqlite3')
+
+# LabResult fields stored per result, in column order
+RESULT_FIELDS = ('test', 'value', 'units', 'low', 'high', 'flag')
+
+
+def patient_key(subject_metadata: dict[str, Any]) -> str:
+    name = subject_metadata.get('Name', '')
+    if isinstance(name, list):
+        name = name[0] if name else ''
+    identity = f"{' '.join(name.split()).casefold()}|{subject_metadata.get('DOB', '')}"
+    return hashlib.sha256(identity.encode()).hexdigest()[:16]
+
+
+def _iso(date: str) -> str:
+    return datetime.strptime(date, '%m/%d/%Y').date().isoformat()
+
+
+def _us(date: str) -> str:
+    return datetime.strptime(date, '%Y-%m-%d').strftime('%m/%d/%Y')
+
+
+class ResultStore:
+    def __init__(self, path: str = RESULTS_DB_PATH):
+        self.path = path
+        prepare(
+            path,
+            'CREATE TABLE IF NOT EXISTS patients ('
+            '  id TEXT PRIMARY KEY,'
+            '  name TEXT NOT NULL,'
+            '  dob TEXT NOT NULL'
+            ')',
+            'CREATE TABLE IF NOT EXISTS uploads ('
+            '  digest TEXT PRIMARY KEY,'
+            '  patient TEXT NOT NULL'
+            ')',
+            'CREATE TABLE IF NOT EXISTS reports ('
+            '  digest TEXT PRIMARY KEY,'
+            '  patient TEXT NOT NULL,'
+            '  collected TEXT NOT NULL,'
+            '  verified REAL NOT NULL'
+            ')',
+            'CREATE TABLE IF NOT EXISTS results ('
+            '  report TEXT NOT NULL,'
+            '  patient TEXT NOT NULL,'
+            '  collected TEXT NOT NULL,'
+            '  position INTEGER NOT NULL,'
+            '  test TEXT NOT NULL COLLATE NOCASE,'
+            '  value TEXT NOT NULL,'
+            '  units TEXT NOT NULL,'
+            '  low TEXT NOT NULL,'
+            '  high TEXT NOT NULL,'
+            '  flag TEXT NOT NULL'
+            ')',
+            'CREATE INDEX IF NOT EXISTS results_report ON results (report)',
+            'CREATE INDEX IF NOT EXISTS results_patient_test ON results (patient, test, collected)',
+            'CREATE INDEX IF NOT EXISTS results_patient_collected ON results (patient, collected)',
+        )
+
+    def save_patient(self, patient: str, name: str, dob: str):
+        with connect(self.path) as conn:
+            conn.execute('INSERT OR REPLACE INTO patients (id, name, dob) VALUES (?, ?, ?)', (patient, name, dob))
+
+    def save_upload(self, digest: str, patient: str):
+        """Record the patient of a parsed report, before it is verified."""
+        with connect(self.path) as conn:
+            conn.execute('INSERT OR REPLACE INTO uploads (digest, patient) VALUES (?, ?)', (digest, patient))
+
+    def owners(self, digests: list[str]) -> dict[str, str]:
+        """The patient of each of ``digests`` that was parsed or verified before."""
+        marks = ', '.join('?' * len(digests))
+        with connect(self.path) as conn:
+            found = conn.execute(
+                f'SELECT digest, patient FROM uploads WHERE digest IN ({marks}) '
+                f'UNION SELECT digest, patient FROM reports WHERE digest IN ({marks})',
+                [*digests, *digests],
+            ).fetchall()
+        return dict(found)
+
+    def save_report(self, digest: str, patient: str, rows: list[LabResult]):
+        """Replace the verified rows of one report; every row carries its collection ``date``."""
+        collected = _iso(rows[0].date) if rows else None
+        with connect(self.path) as conn:
+            conn.execute('DELETE FROM results WHERE report = ?', (digest,))
+            if not rows:
+                conn.execute('DELETE FROM reports WHERE digest = ?', (digest,))
+                return
+            conn.execute(
+                'INSERT OR REPLACE INTO reports (digest, patient, collected, verified) VALUES (?, ?, ?, ?)',
+                (digest, patient, collected, time.time()),
+            )
+            conn.executemany(
+                'INSERT INTO results (report, patient, collected, position, test, value, units, low, high, flag) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [
+                    (digest, patient, _iso(row.date), position, *(getattr(row, k) for k in RESULT_FIELDS))
+                    for position, row in enumerate(rows)
+                ],
+            )
+
+    def patients(self) -> list[dict[str, Any]]:
+        with connect(self.path) as conn:
+            found = conn.execute(
+                'SELECT p.id, p.name, p.dob, COUNT(r.digest), MAX(r.collected) FROM patients p '
+                'JOIN reports r ON r.patient = p.id GROUP BY p.id ORDER BY p.name'
+            ).fetchall()
+        return [
+            {'id': patient, 'name': name, 'dob': dob, 'reports': reports, 'latest': _us(latest)}
+            for patient, name, dob, reports, latest in found
+        ]
+
+    def latest(self, patient: str) -> ResultSet:
+        """The most recent result of every test stored for ``patient``."""
+        with connect(self.path) as conn:
+            found = conn.execute(
+                'SELECT r.collected, r.test, r.value, r.units, r.low, r.high, r.flag FROM results r '
+                'JOIN (SELECT test, MAX(collected) AS collected FROM results WHERE patient = ? GROUP BY test) m '
+                'ON r.test = m.test AND r.collected = m.collected '
+                'WHERE r.patient = ? ORDER BY r.test, r.position',
+                (patient, patient),
+            ).fetchall()
+        return self._results(found)
+
+    def verified(self, digests: list[str]) -> dict[str, tuple[str, str]]:
+        """``(patient, collection date)`` of each of ``digests`` that has stored results."""
+        with connect(self.path) as conn:
+            found = conn.execute(
+                f'SELECT digest, patient, collected FROM reports WHERE digest IN ({", ".join("?" * len(digests))})',
+                digests,
+            ).fetchall()
+        return {digest: (patient, _us(collected)) for digest, patient, collected in found}
+
+    def history(self, reports: list[str]) -> ResultSet:
+        """Every stored result of ``reports``, flagged results first, then by test and date."""
+        with connect(self.path) as conn:
+            found = conn.execute(
+                'SELECT collected, test, value, units, low, high, flag FROM results '
+                f'WHERE report IN ({", ".join("?" * len(reports))}) '
+                "ORDER BY CASE flag WHEN 'High' THEN 0 WHEN 'Low' THEN 1 WHEN 'Abnormal' THEN 2 ELSE 3 END, "
+                'test COLLATE BINARY, collected, report, position',
+                reports,
+            ).fetchall()
+        return self._results(found)
+
+    @staticmethod
+    def _results(found: list[tuple]) -> ResultSet:
+        return ResultSet(
+            LabResult(test, value, units, low, high, flag, _us(collected))
+            for collected, test, value, units, low, high, flag in found
+        )
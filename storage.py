@@ -0,0 +1,173 @@
+"""Storage for uploaded PDFs.
+
+Uploads are written straight from the request body into ``UPLOAD_FOLDER``
+while being hashed and size-checked, so a file is never buffered whole in
+memory nor read back just to compute its digest. Each file ends up at a path
+named after its SHA-256, which removes collisions between users uploading
+files with the same name and stores repeated uploads only once.
+
+Files up to ``UPLOAD_MEMORY_BYTES`` are also kept in memory so PyMuPDF can
+open them without touching the disk. Stored files are removed once they have
+not been uploaded again for ``UPLOAD_RETENTION`` seconds.
+"""
+import hashlib
+import os
+import tempfile
+import time
+from dataclasses import dataclass
+from functools import cached_property
+
+from flask import Request
+from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import RequestEntityTooLarge
+
+UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'uploads')
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', 25 * 1024 * 1024))
+UPLOAD_MEMORY_BYTES = int(os.environ.get('UPLOAD_MEMORY_BYTES', 2 * 1024 * 1024))
+UPLOAD_RETENTION = float(os.environ.get('UPLOAD_RETENTION', 7 * 24 * 60 * 60))
+UPLOAD_CLEANUP_INTERVAL = 60 * 60
+CHUNK_SIZE = 64 * 1024
+
+os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+
+
+@dataclass
+class StoredUpload:
+    filename: str
+    name: str
+    digest: str
+    size: int
+    data: bytes | None = None
+
+    @property
+    def path(self) -> str:
+        return os.path.join(UPLOAD_FOLDER, self.name)
+
+    @property
+    def url(self) -> str:
+        return f'/uploads/{self.name}'
+
+    @property
+    def source(self) -> str | bytes:
+        """What to hand the parser: the bytes when small enough, otherwise the path."""
+        return self.data if self.data is not None else self.path
+
+
+class UploadStream:
+    """Destination for one file of a multipart upload.
+
+    Werkzeug writes the file part here chunk by chunk; every chunk is hashed
+    and counted as it arrives and the upload is abandoned as soon as it
+    exceeds ``max_bytes``.
+    """
+
+    def __init__(self, directory: str = UPLOAD_FOLDER, max_bytes: int = UPLOAD_MAX_BYTES, memory_bytes: int = UPLOAD_MEMORY_BYTES):
+        self.file = tempfile.NamedTemporaryFile(dir=directory, suffix='.part', delete=False)
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.memory = bytearray()
+        self.committed = False
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            self.discard()
+            raise RequestEntityTooLarge(f'Each uploaded file is limited to {self.max_bytes} bytes.')
+        self.sha256.update(data)
+        if self.memory is not None:
+            if self.size <= self.memory_bytes:
+                self.memory += data
+            else:
+                self.memory = None
+        return self.file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.file.name):
+            os.unlink(self.file.name)
+
+    def commit(self, filename: str) -> StoredUpload:
+        """Move the finished file to its content-addressed path."""
+        self.file.close()
+        digest = self.sha256.hexdigest()
+        upload = StoredUpload(
+            filename=os.path.basename(filename or ''),
+            name=f'{digest}.pdf',
+            digest=digest,
+            size=self.size,
+            data=bytes(self.memory) if self.memory is not None else None,
+        )
+        if os.path.exists(upload.path):
+            os.unlink(self.file.name)
+            os.utime(upload.path)
+        else:
+            os.replace(self.file.name, upload.path)
+        self.committed = True
+        return upload
+
+
+class UploadRequest(Request):
+    """Request class that streams file uploads into ``UploadStream``.
+
+    Partial files of uploads that were never stored, e.g. the files received
+    before another one turned out too large, are deleted when the request
+    closes.
+    """
+
+    @cached_property
+    def upload_streams(self) -> list[UploadStream]:
+        return []
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        stream = UploadStream()
+        self.upload_streams.append(stream)
+        return stream
+
+    def close(self):
+        super().close()
+        for stream in self.upload_streams:
+            if not stream.committed:
+                stream.discard()
+
+
+def stored_path(digest: str) -> str | None:
+    """Path of the stored upload with SHA-256 ``digest``, if there is one."""
+    if len(digest) != 64 or digest.strip('0123456789abcdef'):
+        return None
+    path = os.path.join(UPLOAD_FOLDER, f'{digest}.pdf')
+    return path if os.path.exists(path) else None
+
+
+_last_cleanup = 0.0
+
+
+def cleanup_uploads(directory: str = UPLOAD_FOLDER, max_age: float = UPLOAD_RETENTION):
+    """Remove stored uploads, and abandoned partial ones, older than ``max_age``."""
+    cutoff = time.time() - max_age
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.endswith(('.pdf', '.part')):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+def store(fstorage: FileStorage) -> StoredUpload:
+    global _last_cleanup
+    if time.time() - _last_cleanup > UPLOAD_CLEANUP_INTERVAL:
+        _last_cleanup = time.time()
+        cleanup_uploads()
+
+    stream = fstorage.stream
+    if not isinstance(stream, UploadStream):
+        # files not parsed through UploadRequest are copied in the same way
+        stream = UploadStream()
+        while chunk := fstorage.stream.read(CHUNK_SIZE):
+            stream.write(chunk)
+    return stream.commit(fstorage.filename)
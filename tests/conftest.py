@@ -0,0 +1,12 @@
+"""Test setup: import the app modules from the repository root, and keep
+every cache, upload and database in a scratch directory."""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault('LLM_CLIENT', 'fake')
+os.environ.setdefault('UPLOAD_MAX_BYTES', str(1024 * 1024))
+os.chdir(tempfile.mkdtemp(prefix='ailabpdf-tests-'))
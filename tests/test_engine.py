@@ -0,0 +1,62 @@
+import os
+import threading
+import time
+
+import engine
+from benchmarks.synthetic import random_report, render
+
+_parse_isolated = engine._parse_isolated
+
+
+def _parse_or_hang(source):
+    # stands in for a PDF that hangs the parser, or one that takes a while
+    if os.path.basename(source).startswith('hung'):
+        time.sleep(60)
+    if os.path.basename(source).startswith('slow'):
+        time.sleep(1)
+    return _parse_isolated(source)
+
+
+def _reports(tmp_path, prefix, count):
+    paths = []
+    for i in range(count):
+        (tmp_path / f'{prefix}{i}.pdf').write_bytes(render(random_report(5, seed=i)))
+        paths.append(str(tmp_path / f'{prefix}{i}.pdf'))
+    return paths
+
+
+def test_hung_documents_do_not_time_out_the_ones_after_them(tmp_path, monkeypatch):
+    monkeypatch.setattr(engine, '_parse_isolated', _parse_or_hang)
+    hung = [str(tmp_path / f'hung{i}.pdf') for i in range(2)]
+    good = _reports(tmp_path, 'good', 4)
+
+    results = engine.parse_many(hung + good, workers=2, timeout=2)
+
+    assert [result.error for result in results[:2]] == ['Timed out after 2s'] * 2
+    assert [(result.error, len(result.rows)) for result in results[2:]] == [(None, 5)] * 4
+
+
+def test_a_timeout_does_not_fail_other_callers_documents(tmp_path, monkeypatch):
+    monkeypatch.setattr(engine, '_parse_isolated', _parse_or_hang)
+    slow = _reports(tmp_path, 'slow', 4)
+    others = []
+    # another request thread whose documents are being parsed when the pool is replaced
+    thread = threading.Thread(target=lambda: others.extend(engine.parse_many(slow, workers=2, timeout=10)))
+    thread.start()
+    time.sleep(0.5)
+
+    # a lone document goes to the pool too, or it could not time out
+    results = engine.parse_many([str(tmp_path / 'hung.pdf')], workers=2, timeout=1)
+    thread.join()
+
+    assert [result.error for result in results] == ['Timed out after 1s']
+    assert [(result.error, len(result.rows)) for result in others] == [(None, 5)] * 4
+
+
+def test_one_worker_still_times_out(tmp_path, monkeypatch):
+    monkeypatch.setattr(engine, '_parse_isolated', _parse_or_hang)
+    good = _reports(tmp_path, 'good', 1)
+
+    results = engine.parse_many([str(tmp_path / 'hung.pdf')] + good, workers=1, timeout=1)
+
+    assert [(result.error, len(result.rows)) for result in results] == [('Timed out after 1s', 0), (None, 5)]
@@ -0,0 +1,88 @@
+import pytest
+
+from flags import evaluate, insulin_metrics
+from labresult import LabResult
+
+
+@pytest.mark.parametrize('val, low, high, flag', [
+    # numbers against both bounds, which are inclusive
+    ('5.0', '3.4', '10.8', 'Normal'),
+    ('2.1', '3.4', '10.8', 'Low'),
+    ('12', '3.4', '10.8', 'High'),
+    ('3.4', '3.4', '10.8', 'Normal'),
+    ('10.8', '3.4', '10.8', 'Normal'),
+    ('-1', '0', '5', 'Low'),
+    # one bound missing or not a number
+    ('120', '', '99', 'High'),
+    ('7', '', '99', 'Normal'),
+    ('5', '0', '', 'Normal'),
+    ('120', '>39', '99', 'High'),
+    ('20', '>39', '', 'Normal'),
+    # no reference range
+    ('7', 'Not Established', 'Not Established', 'Normal'),
+    ('700', 'N/A', 'N/A', 'Normal'),
+    ('700', '0', 'N/A', 'Normal'),
+    # "<"/">" results are only compared with the bound on their side
+    ('<5', '30.0', '100.0', 'Low'),
+    ('<30', '30.0', '100.0', 'Low'),
+    ('<0.2', '0.0', '1.2', 'Normal'),
+    ('<0.5', '', '1', 'Normal'),
+    ('>150', '30.0', '100.0', 'High'),
+    ('>100', '30.0', '100.0', 'High'),
+    ('>50', '30.0', '100.0', 'Normal'),
+    ('>90', '', '', 'Normal'),
+    ('>90', '>59', '', 'Normal'),
+    ('< 1', 'Not Established', 'Not Established', 'Normal'),
+    ('<', '1', '2', 'Normal'),
+    # qualitative results
+    ('Negative', '', 'Negative', 'Normal'),
+    ('Positive', '', 'Negative', 'High'),
+    ('1+', '', 'Negative', 'High'),
+    ('Trace', '', 'Negative', 'Normal'),
+    # the words are matched anywhere in the result, as they always have been
+    ('Yellow', '', 'Yellow', 'Low'),
+    ('None seen', '', '', 'Normal'),
+    ('High', '', '', 'High'),
+    ('Low', '', '', 'Low'),
+    ('Positive', 'Not Established', 'Not Established', 'Normal'),
+])
+def test_evaluate(val, low, high, flag):
+    assert evaluate(val, low, high) == flag
+
+
+def _results(*rows: tuple[str, str]) -> list[LabResult]:
+    return [LabResult(test, value) for test, value in rows]
+
+
+@pytest.mark.parametrize('results, metrics', [
+    (
+        _results(('Triglycerides', '150'), ('HDL-C', '50'), ('Insulin', '10'), ('Glucose', '90'), ('Hemoglobin A1c', '5.4')),
+        {'trig_hdl_ratio': 3.0, 'homa_ir': 2.22, 'estimated_average_glucose': 108.28},
+    ),
+    # names are matched without case, and the first name that has a number wins
+    (
+        _results(('lipid panel - triglycerides', '88'), ('Triglycerides', '300'), ('HDL Cholesterol', '61')),
+        {'trig_hdl_ratio': 1.44, 'homa_ir': None, 'estimated_average_glucose': None},
+    ),
+    (
+        _results(('Lipid Panel - Triglycerides', 'see note'), ('Triglycerides', '120'), ('HDL-C', '40')),
+        {'trig_hdl_ratio': 3.0, 'homa_ir': None, 'estimated_average_glucose': None},
+    ),
+    # only the first result of a test counts, even when it is not a number
+    (
+        _results(('Glucose', '100'), ('Glucose', '80'), ('Insulin', '<2')),
+        {'trig_hdl_ratio': None, 'homa_ir': 0.49, 'estimated_average_glucose': None},
+    ),
+    (
+        _results(('Insulin', 'Hemolyzed'), ('Insulin', '12'), ('Glucose', '90')),
+        {'trig_hdl_ratio': None, 'homa_ir': None, 'estimated_average_glucose': None},
+    ),
+    # no ratio over an HDL of 0, and nothing from no results
+    (
+        _results(('Triglycerides', '150'), ('HDL-C', '0')),
+        {'trig_hdl_ratio': None, 'homa_ir': None, 'estimated_average_glucose': None},
+    ),
+    ([], {'trig_hdl_ratio': None, 'homa_ir': None, 'estimated_average_glucose': None}),
+])
+def test_insulin_metrics(results, metrics):
+    assert insulin_metrics(results) == metrics
@@ -0,0 +1,11 @@
+import json
+
+import pytest
+
+from benchmarks.golden import CASES, GOLDEN_DIR, parse
+
+
+@pytest.mark.parametrize('case', CASES)
+def test_parser_output_matches_golden(case):
+    output = parse((GOLDEN_DIR / f'{case}.pdf').read_bytes())
+    assert output == json.loads((GOLDEN_DIR / f'{case}.json').read_text())
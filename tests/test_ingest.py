@@ -0,0 +1,33 @@
+import json
+
+import pytest
+
+import ingest
+from benchmarks.golden import single_panel
+from benchmarks.synthetic import render
+
+
+def test_failed_documents_are_retried_on_resume(tmp_path, capsys):
+    archive = tmp_path / 'archive'
+    archive.mkdir()
+    (archive / 'good.pdf').write_bytes(render(*single_panel()))
+    (archive / 'broken.pdf').write_bytes(b'not a pdf')
+    output = tmp_path / 'results.jsonl'
+
+    assert ingest.main([str(archive), '--output', str(output), '--workers', '1']) == 1
+    checkpoint = (tmp_path / 'results.jsonl.checkpoint').read_text().splitlines()
+    assert checkpoint == [str(archive / 'good.pdf')]
+    rows = output.read_text().splitlines()
+    assert rows and all(json.loads(row)['File'] == str(archive / 'good.pdf') for row in rows)
+
+    capsys.readouterr()
+    assert ingest.main([str(archive), '--output', str(output), '--workers', '1']) == 1
+    stderr = capsys.readouterr().err
+    assert 'resuming: 1 documents already done' in stderr
+    assert f'{archive / "broken.pdf"}:' in stderr
+    assert output.read_text().splitlines() == rows
+
+
+def test_timeout_without_worker_processes_is_rejected(tmp_path):
+    with pytest.raises(SystemExit):
+        ingest.main([str(tmp_path), '--output', str(tmp_path / 'results.jsonl'), '--workers', '0', '--timeout', '5'])
@@ -0,0 +1,21 @@
+import io
+import os
+
+import pytest
+
+from app import app
+from storage import UPLOAD_FOLDER, UPLOAD_MAX_BYTES
+
+
+@pytest.mark.parametrize('files', [
+    [('big.pdf', UPLOAD_MAX_BYTES + 1)],
+    # the first file was received whole before the second was turned away
+    [('small.pdf', 1000), ('big.pdf', UPLOAD_MAX_BYTES + 1)],
+])
+def test_too_large_upload_leaves_no_files(files):
+    before = set(os.listdir(UPLOAD_FOLDER))
+    response = app.test_client().post('/parse', data={
+        'file': [(io.BytesIO(b'%PDF-' + b'x' * size), name) for name, size in files],
+    })
+    assert response.status_code == 413
+    assert set(os.listdir(UPLOAD_FOLDER)) == before
@@ -0,0 +1,106 @@
+import io
+import json
+import re
+from html.parser import HTMLParser
+
+from werkzeug.datastructures import MultiDict
+
+from app import RESULTS, app
+from benchmarks.golden import _lipids, missing_previous, single_panel
+from benchmarks.synthetic import LabRow, Panel, Report, render
+from cache import connect
+
+
+class FormInputs(HTMLParser):
+    """The named inputs of the verification form, grouped by the table row they are in."""
+
+    def __init__(self):
+        super().__init__()
+        self.loose, self.rows, self.row = [], [], None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'tr':
+            self.row = []
+        elif tag == 'input' and attrs.get('name'):
+            (self.loose if self.row is None else self.row).append((attrs['name'], attrs.get('value') or ''))
+
+    def handle_endtag(self, tag):
+        if tag == 'tr':
+            if self.row:
+                self.rows.append(self.row)
+            self.row = None
+
+
+def _stored(reports):
+    with connect(RESULTS.path) as conn:
+        found = conn.execute(
+            f'SELECT report, test FROM results WHERE report IN ({", ".join("?" * len(reports))}) '
+            'ORDER BY report, position',
+            list(reports),
+        ).fetchall()
+    return [tuple(row) for row in found]
+
+
+def _verify(client, pdfs, **fields):
+    """Upload ``pdfs``, submit the verification form as shown and return the rows of the final table."""
+    files = [(io.BytesIO(pdf), f'{i}.pdf') for i, pdf in enumerate(pdfs)]
+    response = client.post('/parse', data={'file': files, **fields})
+    form = FormInputs()
+    form.feed(response.get_data(as_text=True))
+    response = client.post('/final', data=MultiDict(form.loose + [field for row in form.rows for field in row]))
+    return json.loads(re.search(r'const allRowsData\s*=\s*(.*);', response.get_data(as_text=True)).group(1))
+
+
+def test_removed_row_is_not_submitted_and_the_rest_stay_aligned():
+    client = app.test_client()
+    files = [(io.BytesIO(render(*case())), f'{case.__name__}.pdf') for case in (single_panel, missing_previous)]
+    response = client.post('/parse', data={'file': files})
+    assert response.status_code == 200
+
+    form = FormInputs()
+    form.feed(response.get_data(as_text=True))
+    # what removeRow does in the browser: the row goes, and everything in it
+    del form.rows[1]
+    response = client.post('/final', data=MultiDict(form.loose + [field for row in form.rows for field in row]))
+    assert response.status_code == 200
+
+    submitted = [(dict(row)['report[]'], dict(row)['test-name[]']) for row in form.rows]
+    reports = {report for report, _ in submitted}
+    assert len(reports) == 2
+    assert _stored(reports) == sorted(submitted, key=lambda row: row[0])
+
+
+def test_final_takes_the_patient_from_the_parsed_report_only():
+    client = app.test_client()
+    response = client.post('/final', data=MultiDict([
+        ('history', '0' * 64),
+        ('report[]', '1' * 64),
+        ('date[]', '03/14/2023'),
+        ('test-name[]', 'Glucose'),
+        ('correct-value[]', '94'),
+    ]))
+    assert response.status_code == 200
+    # neither report was ever parsed, so nothing is stored or read back
+    assert _stored(['0' * 64, '1' * 64]) == []
+    assert client.get('/patients').status_code == 404
+
+
+def test_forged_report_of_the_same_patient_gets_none_of_their_rows():
+    client = app.test_client()
+    _verify(client, [render(*single_panel())])
+
+    # anyone can print the name and date of birth of someone else
+    forged = Report([Panel('Lipid Panel', [LabRow('Triglycerides', '88', '', '', '', 'mg/dL', '0-149')])])
+    rows = _verify(client, [render(forged)], incremental='1')
+    assert [row['TestName'] for row in rows] == ['Triglycerides']
+
+
+def test_incremental_upload_reads_back_only_the_skipped_reports():
+    client = app.test_client()
+    panel, lipids = render(*single_panel()), render(Report([_lipids()]))
+    verified = _verify(client, [lipids])
+    _verify(client, [panel])
+
+    # both are stored, but only the rows of the report uploaded again come back
+    assert _verify(client, [lipids], incremental='1') == verified